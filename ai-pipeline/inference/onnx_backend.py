@@ -0,0 +1,309 @@
+"""
+ONNX Runtime backend for TotalSpineSeg
+Runs the exported step1/step2 nnU-Net networks without PyTorch
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import nibabel as nib
+import onnxruntime as ort
+
+from ai_pipeline.utils.nifti_header import read_header
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+
+# Written by tools/build_trt_engines.py next to the ONNX models
+TRT_MANIFEST = "trt_engines.json"
+TRT_CACHE_DIR = "trt_cache"
+
+
+def shape_key(shape: Sequence[int]) -> str:
+    """Manifest key for a raw (X, Y, Z) volume shape"""
+    return 'x'.join(str(d) for d in shape[:3])
+
+
+def model_filename(step: str, precision: str) -> str:
+    """ONNX file served for a step at a precision, as written by tools/export_onnx.py"""
+    return f"{step}_fp16.onnx" if precision == "fp16" else f"{step}.onnx"
+
+
+def trt_cache_dir(onnx_dir: str, step: str, precision: str, key: str) -> str:
+    """
+    Engine cache directory for one step, precision and volume shape
+
+    Every fixed-shape engine gets its own directory so engines for
+    different shapes never overwrite or evict each other.
+    """
+    return str(Path(onnx_dir) / TRT_CACHE_DIR / f"{step}_{precision}_{key}")
+
+
+def trt_provider_options(input_shape: Sequence[int], cache_dir: str, fp16: bool = True) -> Dict:
+    """TensorRT EP options for an engine specialized to one fixed input shape"""
+    shape = 'input:' + 'x'.join(str(d) for d in input_shape)
+    return {
+        'trt_fp16_enable': fp16,
+        'trt_engine_cache_enable': True,
+        'trt_engine_cache_path': cache_dir,
+        'trt_profile_min_shapes': shape,
+        'trt_profile_opt_shapes': shape,
+        'trt_profile_max_shapes': shape
+    }
+
+
+def tile_starts(image_size: Sequence[int], patch_size: Sequence[int], step_size: float) -> List[List[int]]:
+    """Sliding-window start offsets per axis (same layout as nnU-Net)"""
+    steps = []
+    for image_dim, patch_dim in zip(image_size, patch_size):
+        target_step = patch_dim * step_size
+        num_steps = int(np.ceil((image_dim - patch_dim) / target_step)) + 1
+        max_start = image_dim - patch_dim
+
+        if num_steps > 1:
+            actual_step = max_start / (num_steps - 1)
+        else:
+            actual_step = 0
+
+        steps.append([int(np.round(actual_step * i)) for i in range(num_steps)])
+    return steps
+
+
+def tile_grid(volume_shape: Sequence[int], config: Dict, step_size: float) -> List[List[int]]:
+    """Tile start offsets for a raw (X, Y, Z) volume shape under a step's config"""
+    transpose_forward = config.get('transpose_forward', [0, 1, 2])
+    shape = [volume_shape[i] for i in transpose_forward]
+    padded_shape = [max(s, p) for s, p in zip(shape, config['patch_size'])]
+    return tile_starts(padded_shape, config['patch_size'], step_size)
+
+
+def _gaussian_importance_map(patch_size: Sequence[int], sigma_scale: float = 1. / 8) -> np.ndarray:
+    """Gaussian weights that down-weight tile borders when merging predictions"""
+    gaussian = np.ones(patch_size, dtype=np.float32)
+    for axis, size in enumerate(patch_size):
+        coords = np.arange(size, dtype=np.float32) - (size - 1) / 2
+        sigma = size * sigma_scale
+        shape = [1] * len(patch_size)
+        shape[axis] = size
+        gaussian = gaussian * np.exp(-coords ** 2 / (2 * sigma ** 2)).reshape(shape)
+
+    gaussian /= gaussian.max()
+    # Avoid division by zero when normalizing the merged logits
+    gaussian[gaussian == 0] = gaussian[gaussian > 0].min()
+    return gaussian
+
+
+class OnnxSpineSeg:
+    """
+    Two-stage TotalSpineSeg inference on ONNX Runtime
+    Patch-based sliding window with Gaussian-weighted merge, as in nnU-Net
+
+    Expects step1.onnx / step2.onnx and their JSON sidecars as written by
+    tools/export_onnx.py. Inputs should already be in the model's training
+    spacing; no resampling is performed here.
+
+    EXPERIMENTAL: only the raw networks run here. TotalSpineSeg's resampling
+    to the plan spacing, the step 1 landmark post-processing that feeds the
+    step 2 channel and the mapping from nnU-Net class indices to
+    TotalSpineSeg label values are not reproduced, so labels do not match
+    the CLI and must not reach SEG conversion. Construction fails unless
+    experimental=True.
+
+    When tools/build_trt_engines.py has built TensorRT engines at the
+    requested precision for common volume shapes, volumes whose header dims
+    match one are run through that fixed-shape engine in batches; all others
+    use the generic session.
+
+    precision='fp16' loads the step{1,2}_fp16.onnx models written by
+    tools/export_onnx.py --fp16; their inputs and outputs stay float32.
+    """
+
+    STEPS = ("step1", "step2")
+
+    PRECISIONS = ("fp32", "fp16")
+
+    def __init__(self, onnx_dir: str, providers: Optional[List[str]] = None, tile_step_size: float = 0.5,
+                 precision: str = "fp32", experimental: bool = False):
+        if not experimental:
+            raise ValueError(
+                "The ONNX backend is experimental: it skips TotalSpineSeg's resampling, step 1 "
+                "post-processing and label mapping, so its output is not equivalent to the CLI. "
+                "Pass experimental=True to run it anyway"
+            )
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}. Expected one of {self.PRECISIONS}")
+
+        self.onnx_dir = Path(onnx_dir)
+        self.tile_step_size = tile_step_size
+        self.precision = precision
+
+        available = ort.get_available_providers()
+        self.providers = [p for p in (providers or DEFAULT_PROVIDERS) if p in available]
+
+        self.sessions: Dict[str, ort.InferenceSession] = {}
+        self.configs: Dict[str, Dict] = {}
+        self.model_paths: Dict[str, Path] = {}
+
+        for step in self.STEPS:
+            model_path = self.onnx_dir / model_filename(step, precision)
+            config_path = self.onnx_dir / f"{step}.json"
+            if not model_path.exists() or not config_path.exists():
+                export_cmd = "tools/export_onnx.py --fp16" if precision == "fp16" else "tools/export_onnx.py"
+                raise FileNotFoundError(f"ONNX model not found: {model_path}. Run {export_cmd} first")
+            self.model_paths[step] = model_path
+
+            with open(config_path, 'r') as f:
+                self.configs[step] = json.load(f)
+
+            self.sessions[step] = ort.InferenceSession(str(model_path), providers=self.providers)
+
+        # step -> {precision: {shape_key: {"input_shape": [...], "tiles": n}}}
+        self.trt_engines: Dict[str, Dict[str, Dict]] = {}
+        manifest = self.onnx_dir / TRT_MANIFEST
+        if manifest.exists() and 'TensorrtExecutionProvider' in available:
+            with open(manifest, 'r') as f:
+                self.trt_engines = json.load(f)
+            shapes = sorted(self.trt_engines.get('step2', {}).get(precision, {}))
+            logger.info(f"TensorRT {precision} engines available for shapes: {shapes}")
+        self._trt_sessions: Dict[Tuple[str, str], ort.InferenceSession] = {}
+
+        logger.info(f"ONNX Runtime sessions ready ({precision}): {self.sessions['step1'].get_providers()}")
+
+    def _trt_session(self, step: str, key: Optional[str],
+                     num_tiles: int) -> Optional[Tuple[ort.InferenceSession, int]]:
+        """Shape-specialized TensorRT session and its batch size, or None if no engine matches"""
+        # Only engines built at the requested precision are used
+        entry = self.trt_engines.get(step, {}).get(self.precision, {}).get(key)
+        if entry is None or entry['tiles'] != num_tiles:
+            return None
+
+        if (step, key) not in self._trt_sessions:
+            options = trt_provider_options(
+                entry['input_shape'],
+                trt_cache_dir(str(self.onnx_dir), step, self.precision, key),
+                fp16=self.precision == 'fp16'
+            )
+            self._trt_sessions[(step, key)] = ort.InferenceSession(
+                str(self.model_paths[step]),
+                providers=[('TensorrtExecutionProvider', options)] + self.providers
+            )
+            logger.info(f"   Using TensorRT engine for {step} shape {key}")
+
+        return self._trt_sessions[(step, key)], entry['input_shape'][0]
+
+    def _predict_logits(self, step: str, data: np.ndarray, key: Optional[str] = None) -> np.ndarray:
+        """
+        Sliding-window prediction over a (C, X, Y, Z) volume
+        Returns: (num_classes, X, Y, Z) merged logits
+        """
+        config = self.configs[step]
+        patch_size = tuple(config['patch_size'])
+
+        # Pad volumes smaller than the patch, remembering where to crop back
+        spatial_shape = data.shape[1:]
+        padded_shape = tuple(max(s, p) for s, p in zip(spatial_shape, patch_size))
+        padding = [(0, 0)] + [((p - s) // 2, p - s - (p - s) // 2) for s, p in zip(spatial_shape, padded_shape)]
+        data = np.pad(data, padding, mode='constant')
+        crop = tuple(slice(before, before + s) for (before, _), s in zip(padding[1:], spatial_shape))
+
+        gaussian = _gaussian_importance_map(patch_size)
+        logits = np.zeros((config['num_classes'],) + padded_shape, dtype=np.float32)
+        weights = np.zeros(padded_shape, dtype=np.float32)
+
+        starts = tile_starts(padded_shape, patch_size, self.tile_step_size)
+        tiles = [
+            (slice(x, x + patch_size[0]), slice(y, y + patch_size[1]), slice(z, z + patch_size[2]))
+            for x in starts[0] for y in starts[1] for z in starts[2]
+        ]
+
+        # Specialized engines use a batch size that divides their tile count;
+        # a volume tiled differently (e.g. another tile step) uses the generic session
+        trt = self._trt_session(step, key, len(tiles))
+        session, batch_size = trt or (self.sessions[step], 1)
+        input_name = session.get_inputs()[0].name
+
+        for i in range(0, len(tiles), batch_size):
+            batch_tiles = tiles[i:i + batch_size]
+            batch = np.ascontiguousarray(np.stack([data[(slice(None),) + t] for t in batch_tiles]), dtype=np.float32)
+            predictions = session.run(None, {input_name: batch})[0]
+
+            for tile, prediction in zip(batch_tiles, predictions):
+                logits[(slice(None),) + tile] += prediction * gaussian
+                weights[tile] += gaussian
+
+        logits /= weights
+        return logits[(slice(None),) + crop]
+
+    def _segment(self, step: str, channels: List[np.ndarray], key: Optional[str] = None) -> np.ndarray:
+        """Run one step on a list of (X, Y, Z) channels and return the label map"""
+        config = self.configs[step]
+        transpose_forward = config.get('transpose_forward', [0, 1, 2])
+        transpose_backward = list(np.argsort(transpose_forward))
+
+        data = np.stack([c.transpose(transpose_forward) for c in channels])
+        labels = self._predict_logits(step, data, key).argmax(axis=0).astype(np.uint8)
+        return labels.transpose(transpose_backward)
+
+    @staticmethod
+    def _normalize(image: np.ndarray) -> np.ndarray:
+        """Per-volume z-score normalization (nnU-Net default for MRI)"""
+        return (image - image.mean()) / max(image.std(), 1e-8)
+
+    @staticmethod
+    def _save_labels(labels: np.ndarray, reference: nib.Nifti1Image, output_file: Path):
+        header = reference.header.copy()
+        header.set_data_dtype(np.uint8)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        nib.save(nib.Nifti1Image(labels, reference.affine, header), str(output_file))
+
+    def run(self, input_path: str, output_dir: str, step_only: Optional[int] = None) -> List[str]:
+        """
+        Segment a NIfTI file or every NIfTI file in a directory
+
+        Writes step1_output/ and step2_output/ in the same layout as the
+        TotalSpineSeg CLI.
+
+        Returns:
+            List of written label files
+        """
+        input_path = Path(input_path)
+        output_dir = Path(output_dir)
+
+        if input_path.is_dir():
+            inputs = sorted(p for p in input_path.iterdir() if p.name.endswith(('.nii', '.nii.gz')))
+        else:
+            inputs = [input_path]
+
+        written = []
+        for nifti_file in inputs:
+            logger.info(f"   ONNX inference: {nifti_file.name}")
+            # Header dims select a shape-specialized engine before any voxel is read
+            key = shape_key(read_header(str(nifti_file))['shape'])
+            image = nib.load(str(nifti_file))
+            volume = self._normalize(image.get_fdata(dtype=np.float32))
+
+            step1_file = output_dir / "step1_output" / nifti_file.name
+            step2_file = output_dir / "step2_output" / nifti_file.name
+
+            if step_only == 2:
+                step1_labels = np.asanyarray(nib.load(str(step1_file)).dataobj).astype(np.uint8)
+            else:
+                step1_labels = self._segment("step1", [volume], key)
+                self._save_labels(step1_labels, image, step1_file)
+                written.append(str(step1_file))
+
+            if step_only != 1:
+                # Step 2 takes the step 1 landmarks as an extra input channel
+                channels = [volume]
+                if self.configs["step2"].get('num_input_channels', 1) > 1:
+                    channels.append(step1_labels.astype(np.float32))
+
+                step2_labels = self._segment("step2", channels, key)
+                self._save_labels(step2_labels, image, step2_file)
+                written.append(str(step2_file))
+
+        return written
@@ -8,21 +8,27 @@ import os
 import sys
 import json
 import logging
+import multiprocessing
+import queue
 import subprocess
 import argparse
+import contextlib
+import tempfile
+import time
+import importlib.metadata
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-
-# Configure logging for clinical pipeline
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s',
-    handlers=[
-        logging.FileHandler('/app/logs/spine_segmentation.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from ai_pipeline.utils.log_setup import PIPELINE_LOG_FILE, configure_logging
+from ai_pipeline.utils.nifti_header import read_header
+from ai_pipeline.utils.stage_cache import cache_stage
+from ai_pipeline.utils.tool_verify import verify_tool
+
+if TYPE_CHECKING:
+    import numpy as np
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,16 +37,221 @@ class SpineSegmentationError(Exception):
     pass
 
 
+@dataclass
+class OutputFiles:
+    """
+    Columnar listing of TotalSpineSeg outputs, one row per file
+    Converted to plain lists with to_dict() only where results leave the process
+    """
+    categories: 'np.ndarray'
+    paths: 'np.ndarray'
+    sizes: 'np.ndarray'
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def files(self, category: str) -> 'np.ndarray':
+        """Paths in one output category"""
+        return self.paths[self.categories == category]
+
+    def counts(self, categories: Sequence[str] = ()) -> Dict[str, int]:
+        """Files per category; categories listed but absent count as 0"""
+        import numpy as np
+
+        names, counts = np.unique(self.categories, return_counts=True)
+        summary = dict.fromkeys(categories, 0)
+        summary.update(zip(names.tolist(), counts.tolist()))
+        return summary
+
+    def to_dict(self, categories: Sequence[str] = ()) -> Dict[str, List[str]]:
+        """JSON-friendly {category: [paths]} mapping"""
+        return {category: self.files(category).tolist() for category in self.counts(categories)}
+
+
+def _resident_predict_nnunet(autocast=contextlib.nullcontext):
+    """
+    Drop-in replacement for totalspineseg's predict_nnunet that builds each
+    nnUNetPredictor once and reuses it, so the network weights stay loaded on
+    the device between jobs instead of being read from disk on every call
+
+    Predictions run under autocast(); nnU-Net runs the network in the
+    calling process, so a bf16 autocast here reaches every forward pass.
+    """
+    from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+
+    predictors = {}
+
+    def predict_nnunet(model_folder, images_dir, output_dir, device, folds=(0, 1, 2, 3, 4), step_size=0.5,
+                       disable_tta=False, save_probabilities=False, continue_prediction=False,
+                       checkpoint='checkpoint_final.pth', npp=3, nps=3, prev_stage_predictions=None,
+                       num_parts=1, part_id=0, verbose=False, disable_progress_bar=False):
+        folds = tuple(i if i == 'all' else int(i) for i in folds)
+        key = (str(model_folder), folds, checkpoint, step_size, disable_tta, str(device))
+
+        predictor = predictors.get(key)
+        if predictor is None:
+            predictor = nnUNetPredictor(
+                tile_step_size=step_size,
+                use_gaussian=True,
+                use_mirroring=not disable_tta,
+                perform_everything_on_device=True,
+                device=device,
+                verbose=verbose,
+                verbose_preprocessing=verbose,
+                allow_tqdm=not disable_progress_bar
+            )
+            predictor.initialize_from_trained_model_folder(str(model_folder), list(folds), checkpoint_name=checkpoint)
+            predictors[key] = predictor
+
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        with autocast():
+            predictor.predict_from_files(
+                str(images_dir),
+                str(output_dir),
+                save_probabilities=save_probabilities,
+                overwrite=not continue_prediction,
+                num_processes_preprocessing=npp,
+                num_processes_segmentation_export=nps,
+                folder_with_segs_from_prev_stage=prev_stage_predictions,
+                num_parts=num_parts,
+                part_id=part_id
+            )
+
+    return predict_nnunet
+
+
+def _model_server_loop(job_queue, result_queue, model_data_dir: str, precision: Optional[str] = None):
+    """
+    Persistent model-server worker
+    Imports TotalSpineSeg (Torch, CUDA context) once, keeps the nnU-Net
+    predictors resident and serves jobs until the None sentinel arrives
+    """
+    os.environ['TOTALSPINESEG_DATA'] = model_data_dir
+
+    try:
+        import torch
+        import totalspineseg.inference as totalspineseg_inference
+        from totalspineseg import ZIP_URLS
+        from totalspineseg.init_inference import init_inference
+
+        # Same setup as the totalspineseg CLI, done once for the server's lifetime
+        default_release = list(ZIP_URLS.values())[0].split('/')[-2]
+        init_inference(data_path=Path(model_data_dir), dict_urls=ZIP_URLS, quiet=True)
+
+        if torch.cuda.is_available():
+            torch.set_num_threads(1)
+            torch.set_num_interop_threads(1)
+            device = torch.device('cuda')
+        else:
+            device = torch.device('cpu')
+
+        if precision == 'bf16':
+            if not torch.cuda.is_available() or not torch.cuda.is_bf16_supported():
+                raise RuntimeError("bf16 requires a CUDA GPU with bfloat16 support")
+
+            # nnU-Net's own CUDA autocast picks up the dtype of the enclosing one
+            def autocast():
+                return torch.autocast(device_type='cuda', dtype=torch.bfloat16)
+        else:
+            autocast = contextlib.nullcontext
+
+        # inference() looks predict_nnunet up in its module globals on every
+        # call, so every network call of both steps goes through the resident,
+        # autocast-wrapped predictors in this process
+        totalspineseg_inference.predict_nnunet = _resident_predict_nnunet(autocast)
+    except Exception as e:
+        result_queue.put(('error', f"Cannot load TotalSpineSeg: {e}"))
+        return
+
+    result_queue.put(('ready', None))
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        input_path, output_dir, step_only, output_iso = job
+        try:
+            totalspineseg_inference.inference(
+                input_path=input_path,
+                output_path=output_dir,
+                data_path=Path(model_data_dir),
+                default_release=default_release,
+                device=device,
+                output_iso=output_iso,
+                step1_only=(step_only == 1),
+                quiet=True
+            )
+            result_queue.put(('success', None))
+        except Exception as e:
+            result_queue.put(('error', str(e)))
+
+
 class TotalSpineSegInference:
     """
     Production-ready wrapper for TotalSpineSeg CLI
     Handles two-stage pipeline with validation and error recovery
+
+    With persistent=True a long-lived model-server process keeps TotalSpineSeg
+    loaded between studies; with use_onnx=True the exported networks run on
+    ONNX Runtime in-process; otherwise each call runs the CLI one-shot.
+    The ONNX backend does not reproduce TotalSpineSeg's pre/post-processing
+    or label values and is refused unless experimental_onnx=True.
+
+    precision selects the network precision where the backend allows it:
+    fp32 or fp16 models on ONNX Runtime, bf16 autocast on the model server.
+    nnU-Net already runs fp16 autocast on CUDA, which is the default (None).
+
+    iso_output=True keeps TotalSpineSeg's isotropic output; False writes the
+    masks on each input's voxel grid, which the in-process DICOM SEG encoder
+    needs. ONNX output is always on the input grid.
     """
 
-    def __init__(self, model_data_dir: str = "/app/models"):
+    SERVER_STARTUP_TIMEOUT = 300
+    SERVER_POLL_INTERVAL = 2
+
+    # Precisions each backend can actually apply
+    SUPPORTED_PRECISIONS = {
+        'onnx': ('fp32', 'fp16'),
+        'server': ('fp16', 'bf16'),
+        'cli': ('fp16',)
+    }
+
+    def __init__(self, model_data_dir: str = "/app/models", persistent: bool = False, use_onnx: bool = False,
+                 precision: Optional[str] = None, experimental_onnx: bool = False, iso_output: bool = True):
+        if persistent and use_onnx:
+            raise ValueError("persistent and use_onnx are mutually exclusive")
+        if use_onnx and not experimental_onnx:
+            raise ValueError(
+                "The ONNX backend is experimental and its labels do not match TotalSpineSeg; "
+                "set experimental_onnx=True (--experimental-onnx) to use it"
+            )
+
+        backend = 'onnx' if use_onnx else 'server' if persistent else 'cli'
+        if precision is not None and precision not in self.SUPPORTED_PRECISIONS[backend]:
+            raise ValueError(
+                f"Precision {precision} is not supported by the {backend} backend "
+                f"(supported: {', '.join(self.SUPPORTED_PRECISIONS[backend])})"
+            )
+
         self.model_data_dir = model_data_dir
+        self.persistent = persistent
+        self.use_onnx = use_onnx
+        self.precision = precision
+        self.iso_output = iso_output
+        self._server = None
+        self._job_queue = None
+        self._result_queue = None
+        self._onnx = None
+        self.tool_version = self._totalspineseg_version()
         self._setup_environment()
-        self._verify_totalspineseg()
+
+        # The ONNX backend does not need the TotalSpineSeg CLI
+        if not self.use_onnx:
+            self._verify_totalspineseg()
+
+        if self.persistent:
+            self._start_server()
 
         # Expected output structure from TotalSpineSeg
         self.expected_outputs = [
@@ -59,26 +270,129 @@ class TotalSpineSegInference:
 
         logger.info(f"TotalSpineSeg environment configured: {self.model_data_dir}")
 
+    @staticmethod
+    def _totalspineseg_version() -> str:
+        """Installed TotalSpineSeg version, used to key cached results"""
+        try:
+            return importlib.metadata.version('totalspineseg')
+        except importlib.metadata.PackageNotFoundError:
+            return 'unknown'
+
     def _verify_totalspineseg(self):
         """Verify TotalSpineSeg is installed and accessible"""
         try:
-            result = subprocess.run(
-                ['totalspineseg', '--help'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-
-            if result.returncode == 0:
-                logger.info("TotalSpineSeg verified and ready")
-            else:
-                raise RuntimeError("TotalSpineSeg command failed")
+            verify_tool('totalspineseg', ('--help',), timeout=30)
+            logger.info("TotalSpineSeg verified and ready")
 
-        except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        except RuntimeError as e:
             logger.error(" TotalSpineSeg not found or not working")
             logger.error("Install with: pip install totalspineseg[nnunetv2]")
             raise RuntimeError(f"TotalSpineSeg verification failed: {e}")
 
+    def _start_server(self):
+        """Spawn the persistent model server and wait until TotalSpineSeg is loaded"""
+        # spawn (not fork) so the child gets a clean CUDA context
+        ctx = multiprocessing.get_context('spawn')
+        self._job_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._server = ctx.Process(
+            target=_model_server_loop,
+            args=(self._job_queue, self._result_queue, self.model_data_dir, self.precision),
+            name="totalspineseg-server",
+            daemon=True
+        )
+        self._server.start()
+
+        try:
+            status, message = self._wait_for_result(self.SERVER_STARTUP_TIMEOUT)
+        except queue.Empty:
+            self.shutdown()
+            raise SpineSegmentationError("TotalSpineSeg model server did not start in time")
+
+        if status != 'ready':
+            self.shutdown()
+            raise SpineSegmentationError(f"TotalSpineSeg model server failed to start: {message}")
+
+        logger.info(f"TotalSpineSeg model server ready (pid {self._server.pid})")
+
+    def server_alive(self) -> bool:
+        """Health check for the persistent model server"""
+        return self._server is not None and self._server.is_alive()
+
+    def _wait_for_result(self, timeout: float):
+        """
+        Wait for the model server's next result, checking it is still alive
+        between polls so a crashed server fails at once rather than after the
+        full timeout
+
+        Raises:
+            queue.Empty: no result within timeout
+            SpineSegmentationError: the server process exited
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self._result_queue.get(timeout=max(0, min(self.SERVER_POLL_INTERVAL, deadline - time.monotonic())))
+            except queue.Empty:
+                if not self._server.is_alive():
+                    exitcode = self._server.exitcode
+                    self._server = None
+                    logger.error(f" TotalSpineSeg model server died (exit code {exitcode})")
+                    raise SpineSegmentationError(f"TotalSpineSeg model server died (exit code {exitcode})")
+                if time.monotonic() >= deadline:
+                    raise
+
+    def shutdown(self, timeout: int = 30):
+        """Stop the persistent model server gracefully, terminating it if it hangs"""
+        if self._server is None:
+            return
+
+        if self._server.is_alive():
+            self._job_queue.put(None)
+            self._server.join(timeout)
+
+            if self._server.is_alive():
+                logger.warning("Model server did not exit, terminating")
+                self._server.terminate()
+                self._server.join()
+
+        self._server = None
+        logger.info("TotalSpineSeg model server stopped")
+
+    def _run_on_server(self, input_path: str, output_dir: str, step_only: Optional[int], timeout: int):
+        """Submit one job to the persistent model server and wait for its result"""
+        if not self.server_alive():
+            logger.warning("Model server not running, restarting")
+            self._start_server()
+
+        self._job_queue.put((str(input_path), str(output_dir), step_only, self.iso_output))
+
+        try:
+            status, message = self._wait_for_result(timeout)
+        except queue.Empty:
+            # The job is still running; results would be out of sync with
+            # later submissions, so the server is torn down
+            self._server.terminate()
+            self._server.join()
+            self._server = None
+            logger.error(f" Inference timed out after {timeout} seconds")
+            raise SpineSegmentationError("TotalSpineSeg inference timeout")
+
+        if status != 'success':
+            logger.error(f" TotalSpineSeg failed: {message}")
+            raise SpineSegmentationError(f"Inference failed: {message}")
+
+    def _run_onnx(self, input_path: str, output_dir: Path, step_only: Optional[int]):
+        """Run both stages in-process on ONNX Runtime, loading sessions on first use"""
+        if self._onnx is None:
+            from ai_pipeline.inference.onnx_backend import OnnxSpineSeg
+
+            self._onnx = OnnxSpineSeg(
+                str(Path(self.model_data_dir) / "onnx"), precision=self.precision or 'fp32', experimental=True
+            )
+
+        self._onnx.run(input_path, str(output_dir), step_only=step_only)
+
     def validate_input(self, input_path: str) -> bool:
         """
         Validate input data before processing
@@ -92,27 +406,48 @@ class TotalSpineSegInference:
 
         # Check if NIfTI file or directory
         if input_path.is_file():
-            if not input_path.suffix in ['.nii', '.nii.gz']:
+            if not input_path.name.endswith(('.nii', '.nii.gz')):
                 raise ValueError(f"Invalid file format: {input_path.suffix}. Expected .nii or .nii.gz")
 
             # Basic file size check (should be at least 1MB for spine MRI)
             if input_path.stat().st_size < 1024 * 1024:
                 logger.warning(f"Input file unusually small: {input_path.stat().st_size} bytes")
 
+            self._validate_header(input_path)
+
         elif input_path.is_dir():
             # Check for NIfTI files in directory
-            nii_files = list(input_path.glob("*.nii")) + list(input_path.glob("*.nii.gz"))
+            nii_files = self._find_nifti_files(input_path)
             if not nii_files:
                 raise ValueError(f"No NIfTI files found in directory: {input_path}")
 
             logger.info(f"Found {len(nii_files)} NIfTI files in input directory")
 
+            for nii_file in nii_files:
+                self._validate_header(nii_file)
+
         else:
             raise ValueError(f"Input path is neither file nor directory: {input_path}")
 
         logger.info(f"Input validation passed: {input_path}")
         return True
 
+    @staticmethod
+    def _validate_header(nifti_file: Path):
+        """Check a NIfTI header describes a 3D volume without loading voxel data"""
+        header = read_header(str(nifti_file))
+
+        if header['dim'][0] < 3:
+            raise ValueError(f"Expected a 3D volume, got {header['dim'][0]}D: {nifti_file}")
+
+        logger.info(f"   {nifti_file.name}: shape {header['shape']}, datatype {header['datatype']}")
+
+    @staticmethod
+    def _find_nifti_files(directory: Path) -> List[Path]:
+        """List NIfTI series directly inside a directory (single readdir pass)"""
+        with os.scandir(directory) as it:
+            return [Path(e.path) for e in it if e.name.endswith(('.nii', '.nii.gz')) and e.is_file()]
+
     def _download_models_if_needed(self):
         """Ensure TotalSpineSeg models are downloaded"""
         import totalspineseg.utils as utils
@@ -127,7 +462,9 @@ class TotalSpineSegInference:
                 logger.error(f" Model download failed: {e}")
                 raise SpineSegmentationError("Cannot download TotalSpineSeg models")
 
-    def run_inference(self, input_path: str, output_dir: str, step_only: Optional[int] = None) -> Dict:
+    @cache_stage(inputs=('input_path',), output='output_dir', params=('step_only', 'use_onnx', 'precision', 'iso_output', 'model_data_dir'))
+    def run_inference(self, input_path: str, output_dir: str, step_only: Optional[int] = None,
+                      timeout: int = 1800) -> Dict:
         """
         Run TotalSpineSeg inference on input data
 
@@ -135,6 +472,7 @@ class TotalSpineSegInference:
             input_path: Path to NIfTI file or directory
             output_dir: Path to output directory
             step_only: Run only step 1 or 2 (None runs both)
+            timeout: Timeout in seconds (30 minutes covers large studies)
 
         Returns:
             Dictionary with results and metadata
@@ -142,8 +480,16 @@ class TotalSpineSegInference:
         # Validate inputs
         self.validate_input(input_path)
 
-        # Ensure models are available
-        self._download_models_if_needed()
+        # A directory is handed to TotalSpineSeg as-is so every series in it
+        # shares a single model load
+        if Path(input_path).is_dir():
+            series_count = len(self._find_nifti_files(Path(input_path)))
+        else:
+            series_count = 1
+
+        # Ensure models are available (ONNX models are exported ahead of time)
+        if not self.use_onnx:
+            self._download_models_if_needed()
 
         # Create output directory
         output_path = Path(output_dir)
@@ -166,81 +512,157 @@ class TotalSpineSegInference:
         else:
             logger.info("🔧 Running FULL PIPELINE (Step 1 + Step 2)")
 
-        # Add isotropic output flag for better visualization
-        cmd.append("--iso")
+        # Isotropic output is easier to visualize; without it masks stay on the input grid
+        if self.iso_output:
+            cmd.append("--iso")
 
         logger.info(f"🚀 Starting TotalSpineSeg inference")
-        logger.info(f"   Command: {' '.join(cmd)}")
+        if self.use_onnx:
+            logger.warning("   Backend: ONNX Runtime (EXPERIMENTAL, labels differ from TotalSpineSeg)")
+        elif self.persistent:
+            logger.info("   Backend: persistent model server")
+        else:
+            logger.info(f"   Command: {' '.join(cmd)}")
+        if self.precision:
+            logger.info(f"   Precision: {self.precision}")
         logger.info(f"   Input: {input_path}")
         logger.info(f"   Output: {output_dir}")
 
         # Run inference
-        start_time = datetime.now()
+        model_loads = 0 if (self.persistent or self._onnx is not None) else 1
+        start_time = time.perf_counter()
 
         try:
-            result = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True,
-                timeout=1800  # 30 minute timeout for large studies
-            )
-
-            inference_time = (datetime.now() - start_time).total_seconds()
+            if self.use_onnx:
+                self._run_onnx(input_path, output_path, step_only)
+            elif self.persistent:
+                self._run_on_server(input_path, output_path, step_only, timeout)
+            else:
+                # Output stays bytes; it is only decoded when it gets logged
+                result = subprocess.run(
+                    cmd,
+                    check=True,
+                    capture_output=True,
+                    timeout=timeout
+                )
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("TotalSpineSeg output:\n%s", result.stdout.decode('utf-8', errors='replace'))
+
+            inference_time = time.perf_counter() - start_time
 
             logger.info(f"Inference completed in {inference_time:.2f} seconds")
 
             # Parse and validate outputs
             outputs = self._validate_outputs(output_path)
+            output_summary = outputs.counts(self.expected_outputs)
 
             return {
                 'status': 'success',
                 'inference_time_sec': inference_time,
+                'series_count': series_count,
+                'model_loads': model_loads,
                 'output_directory': str(output_path),
-                'output_files': outputs,
-                'log': result.stdout,
-                'command': ' '.join(cmd)
+                'output_files': outputs.to_dict(self.expected_outputs),
+                'output_summary': output_summary,
+                'command': ' '.join(cmd),
+                # ONNX output stays on the input grid
+                'iso_output': self.iso_output and not self.use_onnx
             }
 
         except subprocess.TimeoutExpired:
-            logger.error(" Inference timed out after 30 minutes")
+            logger.error(f" Inference timed out after {timeout} seconds")
             raise SpineSegmentationError("TotalSpineSeg inference timeout")
 
         except subprocess.CalledProcessError as e:
-            logger.error(f" TotalSpineSeg failed: {e.stderr}")
-            raise SpineSegmentationError(f"Inference failed: {e.stderr}")
+            stderr = e.stderr.decode('utf-8', errors='replace')
+            logger.error(f" TotalSpineSeg failed: {stderr}")
+            raise SpineSegmentationError(f"Inference failed: {stderr}")
+
+        except SpineSegmentationError:
+            raise
 
         except Exception as e:
             logger.error(f" Unexpected error: {e}")
             raise SpineSegmentationError(f"Inference error: {e}")
 
-    def _validate_outputs(self, output_dir: Path) -> Dict[str, List[str]]:
+    def run_batch(self, input_paths: List[str], output_dir: str, step_only: Optional[int] = None,
+                  timeout: int = 1800) -> Dict:
+        """
+        Run TotalSpineSeg once over several NIfTI series
+
+        Each call to the CLI reloads the nnU-Net weights and re-initializes
+        the GPU, so the inputs are symlinked into one staging directory and
+        processed by a single invocation.
+
+        Args:
+            input_paths: Paths to NIfTI files
+            output_dir: Path to output directory
+            step_only: Run only step 1 or 2 (None runs both)
+            timeout: Timeout in seconds
+
+        Returns:
+            Dictionary with results and metadata
+        """
+        # Drop duplicates while keeping the caller's order
+        sources = list(dict.fromkeys(Path(p).resolve() for p in input_paths))
+        if not sources:
+            raise ValueError("No input files provided for batch inference")
+
+        with tempfile.TemporaryDirectory(prefix="totalspineseg_batch_") as batch_dir:
+            for source in sources:
+                if not source.is_file():
+                    raise ValueError(f"Input file does not exist: {source}")
+
+                link = Path(batch_dir) / source.name
+                if link.exists():
+                    raise ValueError(f"Duplicate series filename in batch: {source.name}")
+                link.symlink_to(source)
+
+            logger.info(f"📦 Batching {len(sources)} series into a single TotalSpineSeg run")
+            return self.run_inference(batch_dir, output_dir, step_only=step_only, timeout=timeout)
+
+    def _validate_outputs(self, output_dir: Path) -> OutputFiles:
         """
         Validate TotalSpineSeg output structure
-        Returns: Dictionary of output categories and files
+        Returns: OutputFiles with one row per output file
         """
+        import numpy as np
+
         logger.info("🔍 Validating TotalSpineSeg outputs...")
 
-        outputs = {}
+        categories, paths, sizes = [], [], []
 
+        # One readdir per category directory; missing directories surface as
+        # FileNotFoundError instead of a separate exists() round-trip
         for category in self.expected_outputs:
-            category_dir = output_dir / category
-            if category_dir.exists():
-                files = [str(f) for f in category_dir.glob("*.nii.gz")]
-                outputs[category] = files
-
-                logger.info(f"   {category}: {len(files)} files")
-            else:
+            try:
+                with os.scandir(output_dir / category) as it:
+                    entries = [e for e in it if e.name.endswith(('.nii', '.nii.gz'))]
+            except FileNotFoundError:
                 logger.warning(f"   ⚠️  {category}: directory not found")
-                outputs[category] = []
+                continue
+
+            categories.extend([category] * len(entries))
+            paths.extend(e.path for e in entries)
+            sizes.extend(e.stat().st_size for e in entries)
+            logger.info(f"   {category}: {len(entries)} files")
+
+        outputs = OutputFiles(
+            categories=np.array(categories, dtype=str),
+            paths=np.array(paths, dtype=str),
+            sizes=np.array(sizes, dtype=np.int64)
+        )
 
         # Check for critical outputs
-        step2_output = output_dir / "step2_output"
-        if not step2_output.exists() or not any(step2_output.glob("*.nii.gz")):
+        if not len(outputs.files("step2_output")):
             raise SpineSegmentationError(
                 "Critical output missing: step2_output segmentation files"
             )
 
+        empty = outputs.paths[outputs.sizes == 0]
+        if len(empty):
+            logger.warning(f"   ⚠️  {len(empty)} empty output files, e.g. {empty[0]}")
+
         logger.info("Output validation passed")
         return outputs
 
@@ -253,10 +675,13 @@ class TotalSpineSegInference:
             "pipeline": "TotalSpineSeg Clinical Inference",
             "status": results['status'],
             "inference_time_seconds": results['inference_time_sec'],
+            "series_count": results['series_count'],
+            # Every TotalSpineSeg invocation pays a full model load / GPU warmup
+            "model_loads": results['model_loads'],
             "output_directory": results['output_directory'],
-            "output_summary": {
-                category: len(files)
-                for category, files in results['output_files'].items()
+            # Results restored from older cache entries carry no summary
+            "output_summary": results.get('output_summary') or {
+                category: len(files) for category, files in results['output_files'].items()
             },
             "clinical_validation": {
                 "vertebrae_segments": 50,  # TotalSpineSeg outputs 50+ structures
@@ -292,6 +717,32 @@ def main():
         default="/app/models",
         help="Path to TotalSpineSeg models directory"
     )
+    parser.add_argument(
+        "--onnx",
+        action="store_true",
+        help="Run exported ONNX models with ONNX Runtime instead of the TotalSpineSeg CLI (requires --experimental-onnx)"
+    )
+    parser.add_argument(
+        "--experimental-onnx",
+        action="store_true",
+        help="Accept that --onnx output skips TotalSpineSeg's pre/post-processing and label mapping"
+    )
+    parser.add_argument(
+        "--no-iso",
+        action="store_true",
+        help="Write masks on the input voxel grid instead of TotalSpineSeg's isotropic output"
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Run TotalSpineSeg in a persistent model server process instead of the one-shot CLI"
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["fp32", "fp16", "bf16"],
+        help="Network precision: fp32/fp16 with --onnx, fp16/bf16 with --persistent, "
+             "fp16 with the CLI (default: backend default)"
+    )
     parser.add_argument(
         "--generate-report",
         action="store_true",
@@ -306,15 +757,26 @@ def main():
 
     args = parser.parse_args()
 
+    configure_logging(PIPELINE_LOG_FILE)
+
+    inference = None
     try:
         # Initialize inference engine
-        inference = TotalSpineSegInference(model_data_dir=args.model_dir)
+        inference = TotalSpineSegInference(
+            model_data_dir=args.model_dir,
+            persistent=args.persistent,
+            use_onnx=args.onnx,
+            experimental_onnx=args.experimental_onnx,
+            precision=args.precision,
+            iso_output=not args.no_iso
+        )
 
         # Run inference
         results = inference.run_inference(
             input_path=args.input_path,
             output_dir=args.output_dir,
-            step_only=args.step_only
+            step_only=args.step_only,
+            timeout=args.timeout
         )
 
         # Generate report if requested
@@ -342,6 +804,10 @@ def main():
         print(f"\n UNEXPECTED ERROR: {e}", file=sys.stderr)
         sys.exit(2)
 
+    finally:
+        if inference is not None and inference.persistent:
+            inference.shutdown()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,429 @@
+"""
+In-process NIfTI to DICOM SEG encoder
+Builds BINARY segmentation objects with pydicom and a Numba bit-packing kernel
+"""
+
+import io
+import os
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import nibabel as nib
+import pydicom
+from numba import njit, prange
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.tag import Tag
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from ai_pipeline.preprocessing.dicom_loader import series_geometry
+
+logger = logging.getLogger(__name__)
+
+SEGMENTATION_STORAGE = '1.2.840.10008.5.1.4.1.1.66.4'
+
+# Patient/study attributes carried over from the reference series
+REFERENCE_ATTRIBUTES = (
+    'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex', 'PatientAge',
+    'StudyInstanceUID', 'StudyDate', 'StudyTime', 'StudyID', 'AccessionNumber',
+    'ReferringPhysicianName', 'StudyDescription', 'FrameOfReferenceUID', 'PositionReferenceIndicator'
+)
+
+# Type 2 attributes among them: written empty when the reference lacks them
+TYPE2_ATTRIBUTES = (
+    'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex',
+    'StudyDate', 'StudyTime', 'StudyID', 'AccessionNumber',
+    'ReferringPhysicianName', 'PositionReferenceIndicator'
+)
+
+# Used for labels without segmentAttributes in the metadata
+DEFAULT_CATEGORY = {'CodeValue': '91723000', 'CodingSchemeDesignator': 'SCT', 'CodeMeaning': 'Anatomical Structure'}
+DEFAULT_TYPE = {'CodeValue': '123037004', 'CodingSchemeDesignator': 'SCT', 'CodeMeaning': 'Body Structure'}
+
+
+@njit(parallel=True, cache=True)
+def _label_presence(vol: np.ndarray, num_labels: int) -> np.ndarray:
+    """(num_labels + 1, slices) table of which labels occur in which (slice, row, col) slice"""
+    present = np.zeros((num_labels + 1, vol.shape[0]), dtype=np.bool_)
+    for k in prange(vol.shape[0]):
+        for r in range(vol.shape[1]):
+            for c in range(vol.shape[2]):
+                present[vol[k, r, c], k] = True
+    return present
+
+
+@njit(parallel=True, cache=True)
+def _pack_frames(vol: np.ndarray, frame_slice: np.ndarray, frame_label: np.ndarray) -> np.ndarray:
+    """
+    Bit-pack one binary frame per (slice, label) pair into DICOM SEG pixel data
+
+    Frames are concatenated without padding, LSB first, so each output byte
+    is computed independently and frames need not be byte aligned.
+    """
+    rows, cols = vol.shape[1], vol.shape[2]
+    frame_size = rows * cols
+    total = frame_slice.shape[0] * frame_size
+    out = np.zeros((total + 7) // 8, dtype=np.uint8)
+
+    for b in prange(out.shape[0]):
+        value = 0
+        for bit in range(8):
+            i = b * 8 + bit
+            if i >= total:
+                break
+            f = i // frame_size
+            p = i - f * frame_size
+            if vol[frame_slice[f], p // cols, p % cols] == frame_label[f]:
+                value |= 1 << bit
+        out[b] = value
+    return out
+
+
+def _to_series_grid(labels: np.ndarray, nifti_affine: np.ndarray, series_affine: np.ndarray,
+                    series_shape: Tuple[int, int, int]) -> Optional[np.ndarray]:
+    """
+    Reindex a label volume onto a reference series' (col, row, slice) voxel grid
+
+    Only axis permutations and flips are allowed; returns None when the
+    NIfTI was resampled (e.g. TotalSpineSeg --iso output) or belongs to
+    another series.
+    """
+    m = np.linalg.inv(series_affine) @ nifti_affine
+    rot = np.round(m[:3, :3])
+    if not np.allclose(m[:3, :3], rot, atol=1e-3):
+        return None
+    if not (np.all(np.abs(rot).sum(axis=0) == 1) and np.all(np.abs(rot).sum(axis=1) == 1)):
+        return None
+
+    axes = [int(np.argmax(np.abs(rot[a]))) for a in range(3)]
+    volume = labels.transpose(axes)
+    if volume.shape != tuple(series_shape):
+        return None
+
+    for a in range(3):
+        flipped = rot[a, axes[a]] < 0
+        expected_offset = series_shape[a] - 1 if flipped else 0
+        if abs(m[a, 3] - expected_offset) > 1e-2:
+            return None
+        if flipped:
+            volume = np.flip(volume, axis=a)
+
+    return volume
+
+
+def _code(item: Dict) -> Dataset:
+    code = Dataset()
+    code.CodeValue = item['CodeValue']
+    code.CodingSchemeDesignator = item['CodingSchemeDesignator']
+    code.CodeMeaning = item['CodeMeaning']
+    return code
+
+
+class FastSEGEncoder:
+    """
+    Encode a NIfTI label map as a DICOM SEG without itkimage2segimage
+
+    Handles the common case of a label map on the same voxel grid as one
+    single-frame reference series (axes may be permuted or flipped). Raises
+    ValueError for anything else so callers can fall back to
+    itkimage2segimage.
+    """
+
+    def __init__(self, num_threads: Optional[int] = None):
+        self.num_threads = num_threads or os.cpu_count() or 1
+
+    @staticmethod
+    def _read_header(path: str) -> Optional[Dataset]:
+        try:
+            ds = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+        except Exception:
+            return None
+
+        if 'ImagePositionPatient' not in ds or 'ImageOrientationPatient' not in ds or 'SeriesInstanceUID' not in ds:
+            return None
+        if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1:
+            return None
+        return ds
+
+    def _reference_series(self, input_dicom_dir: str) -> Dict[str, List[Dataset]]:
+        """Headers of every single-frame image series under input_dicom_dir"""
+        paths = [os.path.join(root, name) for root, _, names in os.walk(input_dicom_dir) for name in names]
+
+        series = defaultdict(list)
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            for ds in pool.map(self._read_header, paths):
+                if ds is not None:
+                    series[ds.SeriesInstanceUID].append(ds)
+        return series
+
+    def _match_series(self, labels: np.ndarray, affine: np.ndarray,
+                      series: Dict[str, List[Dataset]]) -> Tuple[List[Dataset], np.ndarray]:
+        """Find the reference series sharing the label map's voxel grid"""
+        for uid, slices in series.items():
+            slices, series_affine = series_geometry(slices)
+            grid = _to_series_grid(labels, affine, series_affine, (slices[0].Columns, slices[0].Rows, len(slices)))
+            if grid is not None:
+                logger.info(f"   Reference series: {uid} ({len(slices)} slices)")
+                return slices, grid
+
+        raise ValueError("no reference series on the segmentation's voxel grid")
+
+    @staticmethod
+    def _segment_attributes(metadata: Dict) -> Dict[int, Dict]:
+        """dcmqi-style segmentAttributes keyed by labelID"""
+        attributes = {}
+        for group in metadata.get('segmentAttributes', []):
+            for item in group:
+                if 'labelID' in item:
+                    attributes[int(item['labelID'])] = item
+        return attributes
+
+    def encode(self, input_nifti: str, input_dicom_dir: str, metadata: Dict) -> FileDataset:
+        """
+        Build a DICOM SEG dataset for a NIfTI label map
+
+        Args:
+            input_nifti: Path to NIfTI label map
+            input_dicom_dir: Directory holding the reference DICOM series
+            metadata: dcmqi-style metadata (series info and segmentAttributes)
+
+        Returns:
+            pydicom FileDataset ready to be written
+
+        Raises:
+            ValueError if the segmentation cannot be encoded in-process
+        """
+        return self._encode(input_nifti, input_dicom_dir, metadata)[0]
+
+    def encode_bytes(self, input_nifti: str, input_dicom_dir: str, metadata: Dict) -> bytes:
+        """
+        Encode a NIfTI label map and serialize it, checked by decoding it again
+
+        Takes the same arguments as encode() and returns the DICOM file bytes.
+
+        Raises:
+            ValueError if the segmentation cannot be encoded in-process
+            RuntimeError if the written SEG does not decode to the label map
+        """
+        ds, slices, vol, segment_labels = self._encode(input_nifti, input_dicom_dir, metadata)
+
+        buffer = io.BytesIO()
+        ds.save_as(buffer)
+        data = buffer.getvalue()
+
+        self._verify_round_trip(data, slices, vol, segment_labels)
+        return data
+
+    @staticmethod
+    def _verify_round_trip(data: bytes, slices: List[Dataset], vol: np.ndarray, segment_labels: List[int]):
+        """Read a serialized SEG back with pydicom and compare its frames to the (slice, row, col) label map"""
+        ds = pydicom.dcmread(io.BytesIO(data))
+        frames, rows, cols = int(ds.NumberOfFrames), int(ds.Rows), int(ds.Columns)
+
+        # Frames are packed LSB first without padding; the element itself may be padded to even length
+        bits = np.unpackbits(np.frombuffer(ds.PixelData, dtype=np.uint8), bitorder='little')
+        if bits.size < frames * rows * cols:
+            raise RuntimeError(f"SEG round trip: pixel data holds {bits.size} bits for {frames} frames")
+        masks = bits[:frames * rows * cols].reshape(frames, rows, cols).astype(bool)
+
+        slice_index = {reference.SOPInstanceUID: k for k, reference in enumerate(slices)}
+        decoded = np.zeros_like(vol)
+        for mask, group in zip(masks, ds.PerFrameFunctionalGroupsSequence):
+            k = slice_index[group.DerivationImageSequence[0].SourceImageSequence[0].ReferencedSOPInstanceUID]
+            label = segment_labels[int(group.SegmentIdentificationSequence[0].ReferencedSegmentNumber) - 1]
+            if decoded[k][mask].any():
+                raise RuntimeError(f"SEG round trip: overlapping segments on slice {k}")
+            decoded[k][mask] = label
+
+        if not np.array_equal(decoded, vol):
+            mismatched = int(np.count_nonzero(decoded != vol))
+            raise RuntimeError(f"SEG round trip: {mismatched} voxels differ from the label map")
+
+    def _encode(self, input_nifti: str, input_dicom_dir: str,
+                metadata: Dict) -> Tuple[FileDataset, List[Dataset], np.ndarray, List[int]]:
+        """encode() plus the reference slices, (slice, row, col) label map and segment labels"""
+        image = nib.load(input_nifti)
+        if len(image.shape) != 3:
+            raise ValueError(f"expected a 3D label map, got shape {image.shape}")
+        labels = np.asanyarray(image.dataobj)
+        if labels.min() < 0 or labels.max() > 255:
+            raise ValueError("labels outside 0-255")
+        labels = labels.astype(np.uint8)
+
+        slices, grid = self._match_series(labels, image.affine, self._reference_series(input_dicom_dir))
+
+        # Kernels work on (slice, row, col), the DICOM frame layout
+        vol = np.ascontiguousarray(grid.transpose(2, 1, 0))
+        present = _label_presence(vol, int(vol.max()))
+        segment_labels = [label for label in range(1, present.shape[0]) if present[label].any()]
+        if not segment_labels:
+            raise ValueError("segmentation is empty")
+
+        frame_label = np.array([label for label in segment_labels for _ in np.flatnonzero(present[label])],
+                               dtype=np.int64)
+        frame_slice = np.concatenate([np.flatnonzero(present[label]) for label in segment_labels]).astype(np.int64)
+        pixel_data = _pack_frames(vol, frame_slice, frame_label)
+
+        ds = self._build_dataset(slices, metadata, segment_labels)
+        ds.NumberOfFrames = len(frame_label)
+        segment_numbers = {label: number for number, label in enumerate(segment_labels, start=1)}
+        ds.PerFrameFunctionalGroupsSequence = Sequence([
+            self._frame_group(slices[k], segment_numbers[label], k)
+            for label, k in zip(frame_label.tolist(), frame_slice.tolist())
+        ])
+        ds.PixelData = pixel_data.tobytes()
+
+        logger.info(f"   Encoded {len(segment_labels)} segments in {len(frame_label)} frames")
+        return ds, slices, vol, segment_labels
+
+    @staticmethod
+    def _frame_group(reference: Dataset, segment_number: int, slice_index: int) -> Dataset:
+        """Per-frame functional group pointing a frame at its segment and source slice"""
+        source = Dataset()
+        source.ReferencedSOPClassUID = reference.SOPClassUID
+        source.ReferencedSOPInstanceUID = reference.SOPInstanceUID
+        source.PurposeOfReferenceCodeSequence = Sequence([_code({
+            'CodeValue': '121322', 'CodingSchemeDesignator': 'DCM',
+            'CodeMeaning': 'Source image for image processing operation'
+        })])
+
+        derivation = Dataset()
+        derivation.DerivationCodeSequence = Sequence([_code({
+            'CodeValue': '113076', 'CodingSchemeDesignator': 'DCM', 'CodeMeaning': 'Segmentation'
+        })])
+        derivation.SourceImageSequence = Sequence([source])
+
+        content = Dataset()
+        content.DimensionIndexValues = [segment_number, slice_index + 1]
+
+        position = Dataset()
+        position.ImagePositionPatient = list(reference.ImagePositionPatient)
+
+        identification = Dataset()
+        identification.ReferencedSegmentNumber = segment_number
+
+        group = Dataset()
+        group.DerivationImageSequence = Sequence([derivation])
+        group.FrameContentSequence = Sequence([content])
+        group.PlanePositionSequence = Sequence([position])
+        group.SegmentIdentificationSequence = Sequence([identification])
+        return group
+
+    def _build_dataset(self, slices: List[Dataset], metadata: Dict, segment_labels: List[int]) -> FileDataset:
+        """SEG dataset with everything except per-frame groups and pixel data"""
+        first = slices[0]
+        now = datetime.now()
+
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = SEGMENTATION_STORAGE
+        file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = FileDataset(None, {}, file_meta=file_meta, preamble=b'\0' * 128)
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+
+        for keyword in REFERENCE_ATTRIBUTES:
+            if keyword in first:
+                setattr(ds, keyword, first.data_element(keyword).value)
+            elif keyword in TYPE2_ATTRIBUTES:
+                setattr(ds, keyword, '')
+
+        ds.SOPClassUID = SEGMENTATION_STORAGE
+        ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+        ds.Modality = 'SEG'
+        ds.SeriesInstanceUID = generate_uid()
+        ds.SeriesNumber = metadata.get('SeriesNumber', '1001')
+        ds.SeriesDescription = metadata.get('SeriesDescription', 'AI Spine Segmentation')
+        ds.InstanceNumber = metadata.get('InstanceNumber', '1')
+        ds.BodyPartExamined = metadata.get('BodyPart', 'SPINE')
+        ds.ContentCreatorName = metadata.get('ContentCreatorName', 'SpineAISystem')
+        ds.ContentLabel = 'SEGMENTATION'
+        ds.ContentDescription = metadata.get('SegmentLabel', 'SpineSegmentation')
+        ds.ContentDate = ds.SeriesDate = now.strftime('%Y%m%d')
+        ds.ContentTime = ds.SeriesTime = now.strftime('%H%M%S')
+        ds.Manufacturer = 'SpineAISystem'
+        ds.ManufacturerModelName = 'TotalSpineSeg'
+        ds.SoftwareVersions = 'fast_seg_encoder'
+        ds.DeviceSerialNumber = '1'
+
+        ds.ImageType = ['DERIVED', 'PRIMARY']
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.Rows = first.Rows
+        ds.Columns = first.Columns
+        ds.BitsAllocated = 1
+        ds.BitsStored = 1
+        ds.HighBit = 0
+        ds.PixelRepresentation = 0
+        ds.LossyImageCompression = '00'
+        ds.SegmentationType = 'BINARY'
+
+        # Frames are indexed by segment, then by slice position
+        dimension_uid = generate_uid()
+        organization = Dataset()
+        organization.DimensionOrganizationUID = dimension_uid
+        ds.DimensionOrganizationSequence = Sequence([organization])
+
+        segment_index = Dataset()
+        segment_index.DimensionOrganizationUID = dimension_uid
+        segment_index.DimensionIndexPointer = Tag('ReferencedSegmentNumber')
+        segment_index.FunctionalGroupPointer = Tag('SegmentIdentificationSequence')
+        position_index = Dataset()
+        position_index.DimensionOrganizationUID = dimension_uid
+        position_index.DimensionIndexPointer = Tag('ImagePositionPatient')
+        position_index.FunctionalGroupPointer = Tag('PlanePositionSequence')
+        ds.DimensionIndexSequence = Sequence([segment_index, position_index])
+
+        # Geometry shared by every frame
+        orientation = Dataset()
+        orientation.ImageOrientationPatient = list(first.ImageOrientationPatient)
+        measures = Dataset()
+        measures.PixelSpacing = list(first.PixelSpacing)
+        measures.SliceThickness = getattr(first, 'SliceThickness', 1)
+        if len(slices) > 1:
+            spacing = np.linalg.norm(np.subtract(slices[1].ImagePositionPatient, slices[0].ImagePositionPatient))
+            measures.SpacingBetweenSlices = f"{spacing:.6g}"
+        shared = Dataset()
+        shared.PlaneOrientationSequence = Sequence([orientation])
+        shared.PixelMeasuresSequence = Sequence([measures])
+        ds.SharedFunctionalGroupsSequence = Sequence([shared])
+
+        attributes = self._segment_attributes(metadata)
+        segments = []
+        for number, label in enumerate(segment_labels, start=1):
+            item = attributes.get(label, {})
+            segment = Dataset()
+            segment.SegmentNumber = number
+            # dcmqi templates (config/metadata_templates) name segments via SegmentDescription
+            segment.SegmentLabel = item.get('SegmentLabel') or item.get('SegmentDescription') or f"Label {label}"
+            if 'SegmentDescription' in item:
+                segment.SegmentDescription = item['SegmentDescription']
+            segment.SegmentAlgorithmType = item.get('SegmentAlgorithmType', 'AUTOMATIC')
+            if segment.SegmentAlgorithmType != 'MANUAL':
+                segment.SegmentAlgorithmName = item.get('SegmentAlgorithmName', 'TotalSpineSeg')
+            segment.SegmentedPropertyCategoryCodeSequence = Sequence([
+                _code(item.get('SegmentedPropertyCategoryCodeSequence', DEFAULT_CATEGORY))
+            ])
+            segment.SegmentedPropertyTypeCodeSequence = Sequence([
+                _code(item.get('SegmentedPropertyTypeCodeSequence', DEFAULT_TYPE))
+            ])
+            segments.append(segment)
+        ds.SegmentSequence = Sequence(segments)
+
+        instances = []
+        for reference in slices:
+            instance = Dataset()
+            instance.ReferencedSOPClassUID = reference.SOPClassUID
+            instance.ReferencedSOPInstanceUID = reference.SOPInstanceUID
+            instances.append(instance)
+        referenced_series = Dataset()
+        referenced_series.SeriesInstanceUID = first.SeriesInstanceUID
+        referenced_series.ReferencedInstanceSequence = Sequence(instances)
+        ds.ReferencedSeriesSequence = Sequence([referenced_series])
+
+        return ds
@@ -5,36 +5,76 @@ Generates DICOM SEG objects for PACS integration
 
 import os
 import json
+import time
+import argparse
+import tempfile
 import subprocess
 import logging
 from datetime import datetime
 
-logging.basicConfig(level=logging.INFO)
+from ai_pipeline.utils.log_setup import configure_logging
+from ai_pipeline.utils.stage_cache import cache_stage
+from ai_pipeline.utils.tool_verify import read_tool_version, verify_tool
+
 logger = logging.getLogger(__name__)
 
+# Metadata only lives for the duration of one itkimage2segimage call; keep it
+# in memory-backed tmpfs when the host has one
+METADATA_TMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
 
 class SEGConverter:
     """
     Convert NIfTI segmentations to DICOM SEG format
     Optimized for TotalSpineSeg output integration
+
+    By default label maps on the reference series' voxel grid are encoded
+    in-process (FastSEGEncoder); anything else, or use_itk=True, goes
+    through itkimage2segimage.
+
+    With use_uring=True the output is written through io_uring and flushed
+    once at the end of each conversion; use the converter as a context
+    manager (or call close()) to release the ring.
     """
 
-    def __init__(self, metadata_template_path=None):
+    def __init__(self, metadata_template_path=None, use_uring=False, use_itk=False):
         self.metadata_template_path = metadata_template_path
-        self._verify_itk_converter()
+        self.use_itk = use_itk
+        self.itk_available = False
+        self._encoder = None
+
+        try:
+            self._verify_itk_converter()
+            self.itk_available = True
+        except RuntimeError:
+            # Only fatal when there is no in-process encoder to use instead
+            if use_itk:
+                raise
+            logger.warning("itkimage2segimage not found; only the in-process SEG encoder is available")
+
+        # Optional io_uring writer (Linux only) for output files
+        self._uring = None
+        if use_uring:
+            from ai_pipeline.utils.uring_writer import IoUringBatchEngine
+
+            self._uring = IoUringBatchEngine(entries=64, max_batch=16)
+            logger.info("io_uring output writer enabled")
 
     def _verify_itk_converter(self):
         """Verify itkimage2segimage tool is available"""
         try:
-            result = subprocess.run(['itkimage2segimage', '--help'],
-                                    capture_output=True, text=True)
-            if result.returncode not in [0, 1]:  # Help often returns 1
-                raise RuntimeError("itkimage2segimage not found")
-        except FileNotFoundError:
+            # Help/version output often exits with 1
+            verify_tool('itkimage2segimage', ('--version',), ok_returncodes=(0, 1))
+        except RuntimeError:
             raise RuntimeError(
                 "itkimage2segimage not found. Install from plastimatch or Slicer"
             )
 
+    @property
+    def tool_version(self):
+        """itkimage2segimage version for cache keys, probed on first use"""
+        return read_tool_version('itkimage2segimage', ('--version',))
+
     def load_metadata_template(self, study_info=None):
         """
         Load DICOM SEG metadata template with study-specific information
@@ -59,7 +99,99 @@ class SEGConverter:
 
         return default_metadata
 
-    def convert_to_seg(self, input_nifti, input_dicom_dir, output_seg, metadata=None):
+    def close(self):
+        """Complete pending io_uring writes and release the ring"""
+        if self._uring is not None:
+            self._uring.close()
+            self._uring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write_file(self, path, data):
+        """Write bytes to path, queued on io_uring until the stage flushes when enabled"""
+        if self._uring is None:
+            with open(path, 'wb') as f:
+                f.write(data)
+            return
+
+        self._uring.write_file(path, data)
+
+    def _encode_in_process(self, input_nifti, input_dicom_dir, output_seg, metadata) -> bool:
+        """
+        Encode with FastSEGEncoder and write output_seg
+        Returns: False if the segmentation needs itkimage2segimage instead
+        """
+        try:
+            if self._encoder is None:
+                # Needs numpy, nibabel, pydicom and numba; ImportError falls back below
+                from ai_pipeline.postprocessing.fast_seg_encoder import FastSEGEncoder
+
+                self._encoder = FastSEGEncoder()
+
+            # Decoded again and compared to the label map before it is written
+            data = self._encoder.encode_bytes(input_nifti, input_dicom_dir, metadata)
+        except Exception as e:
+            if not self.itk_available:
+                raise RuntimeError(f"In-process SEG encoding failed and itkimage2segimage is not installed: {e}")
+
+            # ValueError means the segmentation does not suit the fast path;
+            # anything else (missing module, unreadable NIfTI, incomplete DICOM
+            # geometry) is a failure of the encoder itself
+            if isinstance(e, ValueError):
+                logger.info(f"In-process encoder not applicable ({e}), using itkimage2segimage")
+            else:
+                logger.warning(f"In-process encoder failed ({type(e).__name__}: {e}), using itkimage2segimage")
+            return False
+
+        self._write_file(output_seg, data)
+        return True
+
+    def _run_itkimage2segimage(self, input_nifti, input_dicom_dir, output_seg, metadata):
+        """Convert with the itkimage2segimage binary"""
+        if not self.itk_available:
+            raise RuntimeError("itkimage2segimage not found. Install from plastimatch or Slicer")
+
+        # itkimage2segimage only reads metadata from a path; the temporary
+        # file is removed when the with block exits. It is read straight
+        # away, so it is written directly rather than queued on io_uring
+        with tempfile.NamedTemporaryFile(suffix='_metadata.json', dir=METADATA_TMP_DIR) as metadata_file:
+            metadata_file.write(json.dumps(metadata).encode())
+            metadata_file.flush()
+
+            # Build command
+            cmd = [
+                "itkimage2segimage",
+                "--inputImageList", input_nifti,
+                "--inputDICOMDirectory", input_dicom_dir,
+                "--outputDICOM", output_seg,
+                "--inputMetadata", metadata_file.name,
+                "--skip"
+            ]
+
+            logger.info(f"Running: {' '.join(cmd)}")
+
+            try:
+                result = subprocess.run(
+                    cmd,
+                    check=True,
+                    capture_output=True
+                )
+            except subprocess.CalledProcessError as e:
+                stderr = e.stderr.decode('utf-8', errors='replace')
+                logger.error(f"Conversion failed: {stderr}")
+                raise RuntimeError(f"itkimage2segimage failed: {stderr}")
+
+            # Output stays bytes; it is only decoded when it gets logged
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("itkimage2segimage output:\n%s", result.stdout.decode('utf-8', errors='replace'))
+
+    @cache_stage(inputs=('input_nifti', 'input_dicom_dir'), output='output_seg',
+                 params=('metadata', 'use_itk', 'source_space'))
+    def convert_to_seg(self, input_nifti, input_dicom_dir, output_seg, metadata=None, source_space=True):
         """
         Convert NIfTI segmentation to DICOM SEG
 
@@ -68,6 +200,9 @@ class SEGConverter:
             input_dicom_dir: Path to source DICOM directory (for reference)
             output_seg: Path for output DICOM SEG file
             metadata: Optional metadata dict
+            source_space: False when the mask was resampled off the source
+                grid (e.g. TotalSpineSeg --iso output); the in-process encoder
+                cannot use it, so its DICOM scan and NIfTI load are skipped
         """
         logger.info("Converting NIfTI to DICOM SEG")
         logger.info(f"Input NIfTI: {input_nifti}")
@@ -88,50 +223,24 @@ class SEGConverter:
         if metadata is None:
             metadata = self.load_metadata_template()
 
-        # Write metadata to temporary file
-        metadata_path = output_seg.replace('.dcm', '_metadata.json')
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
-
-        try:
-            # Build command
-            cmd = [
-                "itkimage2segimage",
-                "--inputImageList", input_nifti,
-                "--inputDICOMDirectory", input_dicom_dir,
-                "--outputDICOM", output_seg,
-                "--inputMetadata", metadata_path,
-                "--skip"
-            ]
-
-            logger.info(f"Running: {' '.join(cmd)}")
+        start_time = time.perf_counter()
 
-            result = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
+        in_process = not self.use_itk and source_space
+        if not in_process or not self._encode_in_process(input_nifti, input_dicom_dir, output_seg, metadata):
+            self._run_itkimage2segimage(input_nifti, input_dicom_dir, output_seg, metadata)
 
-            logger.info("DICOM SEG conversion successful")
+        # One flush per conversion completes and fsyncs the queued output
+        if self._uring is not None:
+            self._uring.flush()
 
-            # Clean up metadata file
-            if os.path.exists(metadata_path):
-                os.remove(metadata_path)
+        conversion_time = time.perf_counter() - start_time
+        logger.info(f"DICOM SEG conversion successful in {conversion_time:.2f} seconds")
 
-            return {
-                'status': 'success',
-                'output_file': output_seg,
-                'log': result.stdout
-            }
-
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Conversion failed: {e.stderr}")
-            raise RuntimeError(f"itkimage2segimage failed: {e.stderr}")
-        finally:
-            # Cleanup
-            if os.path.exists(metadata_path):
-                os.remove(metadata_path)
+        return {
+            'status': 'success',
+            'output_file': output_seg,
+            'conversion_time_sec': conversion_time
+        }
 
 
 def main():
@@ -145,23 +254,30 @@ def main():
     parser.add_argument("dicom_dir", help="Reference DICOM directory")
     parser.add_argument("output_seg", help="Output DICOM SEG file")
     parser.add_argument("--metadata", help="JSON metadata file path")
+    parser.add_argument("--use-uring", action="store_true", help="Write outputs via io_uring (Linux only)")
+    parser.add_argument("--use-itk", action="store_true",
+                        help="Always convert with itkimage2segimage instead of the in-process encoder")
+    parser.add_argument("--resampled", action="store_true",
+                        help="Segmentation is not on the source series grid (e.g. TotalSpineSeg --iso output)")
 
     args = parser.parse_args()
 
-    try:
-        converter = SEGConverter()
+    configure_logging()
 
+    try:
         metadata = None
         if args.metadata:
             with open(args.metadata, 'r') as f:
                 metadata = json.load(f)
 
-        result = converter.convert_to_seg(
-            args.nifti_file,
-            args.dicom_dir,
-            args.output_seg,
-            metadata
-        )
+        with SEGConverter(use_uring=args.use_uring, use_itk=args.use_itk) as converter:
+            result = converter.convert_to_seg(
+                args.nifti_file,
+                args.dicom_dir,
+                args.output_seg,
+                metadata,
+                source_space=not args.resampled
+            )
 
         print(f"\nDICOM SEG created: {result['output_file']}")
 
@@ -4,12 +4,18 @@ Optimized for spine MRI studies in clinical AI pipeline
 """
 
 import os
+import time
+import shutil
 import argparse
 import subprocess
 import logging
+from collections import deque
+
+from ai_pipeline.utils.log_setup import configure_logging
+from ai_pipeline.utils.nifti_header import read_header
+from ai_pipeline.utils.stage_cache import cache_stage
+from ai_pipeline.utils.tool_verify import read_tool_version, verify_tool
 
-# Configure logging for production
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
@@ -19,22 +25,35 @@ class DICOMConverter:
     Designed for TotalSpineSeg pipeline integration
     """
 
-    def __init__(self, output_compression=True, anonymize=False):
+    def __init__(self, output_compression=True, anonymize=False, compression_threads=None):
         self.output_compression = output_compression
         self.anonymize = anonymize
+        self.compression_threads = compression_threads
         self._verify_dcm2niix()
 
+        # dcm2niix's internal zlib is single-threaded; pigz compresses on all cores
+        self.pigz_available = shutil.which('pigz') is not None
+        if self.output_compression and not self.pigz_available:
+            logger.warning("pigz not found; dcm2niix will fall back to single-threaded gzip")
+
     def _verify_dcm2niix(self):
         """Verify dcm2niix is installed and accessible"""
         try:
-            result = subprocess.run(['dcm2niix', '-v'],
-                                    capture_output=True, text=True, check=True)
-            logger.info(f"dcm2niix verified: {result.stdout.strip()}")
-        except (subprocess.CalledProcessError, FileNotFoundError):
+            banner = verify_tool('dcm2niix', ('-v',))
+        except RuntimeError:
             raise RuntimeError(
                 "dcm2niix not found. Install from https://github.com/rordenlab/dcm2niix"
             )
 
+        if banner:
+            logger.info(f"dcm2niix verified: {banner.strip()}")
+
+    @property
+    def tool_version(self):
+        """dcm2niix version for cache keys, probed on first use"""
+        return read_tool_version('dcm2niix', ('-v',))
+
+    @cache_stage(inputs=('input_dir',), output='output_dir', params=('output_compression', 'anonymize'))
     def convert_study(self, input_dir, output_dir, study_description="spine"):
         """
         Convert DICOM study to NIfTI format optimized for TotalSpineSeg
@@ -62,49 +81,82 @@ class DICOMConverter:
         cmd = [
             "dcm2niix",
             "-o", output_dir,
-            "-z", "y" if self.output_compression else "n",
+            "-z", self._compression_mode(),
             "-ba", "y" if self.anonymize else "n",
             "-f", "%p_%s_%d",  # Filename: Protocol_Series_Description
-            "-v", "1",  # Verbose output
             input_dir
         ]
 
-        try:
-            logger.info(f"Running: {' '.join(cmd)}")
+        logger.info(f"Running: {' '.join(cmd)}")
+
+        # pigz reads extra options from $PIGZ (default: one thread per core)
+        env = None
+        if self.pigz_available and self.compression_threads:
+            env = dict(os.environ, PIGZ=f"-p {self.compression_threads}")
+
+        # Created files are found by diffing the output directory, so the
+        # dcm2niix log is only needed when debugging
+        before = self._snapshot(output_dir)
+        start_time = time.perf_counter()
 
-            result = subprocess.run(
+        if logger.isEnabledFor(logging.DEBUG):
+            tail = deque(maxlen=20)  # last lines, for error reporting
+            with subprocess.Popen(
                 cmd,
-                check=True,
-                capture_output=True,
-                text=True
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                env=env
+            ) as proc:
+                for line in proc.stdout:
+                    line = line.rstrip('\n')
+                    tail.append(line)
+                    logger.debug(line)
+            errors = '\n'.join(tail).encode()
+        else:
+            proc = subprocess.run(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                env=env
             )
+            errors = proc.stderr
+
+        if proc.returncode != 0:
+            # Decode only on failure
+            message = errors.decode('utf-8', errors='replace').strip() or "enable debug logging for dcm2niix output"
+            logger.error(f" Conversion failed: {message}")
+            raise RuntimeError(f"dcm2niix failed: {message}")
+
+        conversion_time = time.perf_counter() - start_time
+        logger.info(f" Conversion successful in {conversion_time:.2f} seconds")
+
+        after = self._snapshot(output_dir)
+        output_files = sorted(
+            os.path.join(output_dir, name)
+            for name, mtime in after.items()
+            if name.endswith(('.nii', '.nii.gz')) and before.get(name) != mtime
+        )
 
-            logger.info(" Conversion successful")
-
-            # Parse output files
-            output_files = self._parse_dcm2niix_output(result.stdout, output_dir)
-
-            return {
-                'status': 'success',
-                'output_files': output_files,
-                'log': result.stdout
-            }
-
-        except subprocess.CalledProcessError as e:
-            logger.error(f" Conversion failed: {e.stderr}")
-            raise RuntimeError(f"dcm2niix failed: {e.stderr}")
-
-    def _parse_dcm2niix_output(self, stdout, output_dir):
-        """Parse dcm2niix output to identify created files"""
-        files = []
-        for line in stdout.split('\n'):
-            if "Saving:" in line or "Convert:" in line:
-                # Extract filename from dcm2niix output
-                parts = line.split()
-                for part in parts:
-                    if part.endswith('.nii') or part.endswith('.nii.gz'):
-                        files.append(os.path.join(output_dir, part))
-        return files
+        return {
+            'status': 'success',
+            'output_files': output_files,
+            'conversion_time_sec': conversion_time
+        }
+
+    def _compression_mode(self):
+        """dcm2niix -z value: pipe straight to pigz when it is installed"""
+        if not self.output_compression:
+            return "n"
+        # o = optimal: stream to pigz without an uncompressed temporary file
+        return "o" if self.pigz_available else "y"
+
+    @staticmethod
+    def _snapshot(directory):
+        """Map file name -> mtime for the files directly inside a directory"""
+        with os.scandir(directory) as it:
+            return {e.name: e.stat().st_mtime_ns for e in it if e.is_file()}
 
     def validate_output(self, output_dir):
         """
@@ -118,12 +170,24 @@ class DICOMConverter:
 
         logger.info(f"Generated {len(nifti_files)} NIfTI files")
 
-        # Additional validation: check file size, dimensions
+        # Additional validation: check file size, dimensions (header only)
         valid_files = []
         for nii_file in nifti_files:
             filepath = os.path.join(output_dir, nii_file)
-            if os.path.getsize(filepath) > 1024:  # At least 1KB
-                valid_files.append(filepath)
+            if os.path.getsize(filepath) <= 1024:  # At least 1KB
+                continue
+
+            try:
+                header = read_header(filepath)
+            except ValueError as e:
+                logger.warning(f"Skipping invalid NIfTI: {e}")
+                continue
+
+            if header['dim'][0] < 3:
+                logger.warning(f"Skipping {nii_file}: not a 3D volume (dim {header['dim']})")
+                continue
+
+            valid_files.append(filepath)
 
         return valid_files
 
@@ -139,13 +203,17 @@ def main():
     parser.add_argument("output_dir", help="Output NIfTI directory")
     parser.add_argument("--no-compress", action="store_true", help="Disable compression")
     parser.add_argument("--anonymize", action="store_true", help="Anonymize output")
+    parser.add_argument("--compress-threads", type=int, help="pigz threads (default: all cores)")
 
     args = parser.parse_args()
 
+    configure_logging()
+
     try:
         converter = DICOMConverter(
             output_compression=not args.no_compress,
-            anonymize=args.anonymize
+            anonymize=args.anonymize,
+            compression_threads=args.compress_threads
         )
 
         result = converter.convert_study(args.input_dir, args.output_dir)
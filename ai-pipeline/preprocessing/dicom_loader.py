@@ -0,0 +1,196 @@
+"""
+In-process DICOM to NIfTI conversion with pydicom
+Alternative to the dcm2niix subprocess for standard single-frame spine MRI series
+"""
+
+import os
+import re
+import string
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+import nibabel as nib
+import pydicom
+
+logger = logging.getLogger(__name__)
+
+
+def series_geometry(slices: List[pydicom.Dataset]) -> Tuple[List[pydicom.Dataset], np.ndarray]:
+    """
+    Sort one series' slices along the slice normal
+
+    Returns:
+        (sorted slices, RAS affine of the stacked volume), where voxel
+        (i, j, k) is column i, row j of the k-th sorted slice
+    """
+    first = slices[0]
+    orientation = np.array(first.ImageOrientationPatient, dtype=np.float64)
+    row_cos, col_cos = orientation[:3], orientation[3:]
+    normal = np.cross(row_cos, col_cos)
+
+    slices = sorted(slices, key=lambda ds: float(np.dot(np.array(ds.ImagePositionPatient, dtype=np.float64), normal)))
+    positions = np.array([ds.ImagePositionPatient for ds in slices], dtype=np.float64)
+
+    row_spacing, col_spacing = (float(v) for v in first.PixelSpacing)
+    if len(slices) > 1:
+        slice_step = (positions[-1] - positions[0]) / (len(slices) - 1)
+    else:
+        slice_step = normal * float(getattr(first, 'SliceThickness', 1) or 1)
+
+    # Affine in DICOM LPS, then flipped to NIfTI RAS
+    affine = np.eye(4)
+    affine[:3, 0] = row_cos * col_spacing
+    affine[:3, 1] = col_cos * row_spacing
+    affine[:3, 2] = slice_step
+    affine[:3, 3] = positions[0]
+    affine[:2, :] *= -1
+
+    return slices, affine
+
+
+class DICOMVolumeLoader:
+    """
+    Assemble DICOM series into volumes in-process and save uncompressed NIfTI
+
+    Slices are read and decoded on a thread pool, and volumes are written as
+    plain .nii, so there is no subprocess, no gzip compress on write and no
+    gzip decompress when TotalSpineSeg reads them back. Multi-frame and
+    mosaic series are skipped; use DICOMConverter (dcm2niix) for those.
+
+    Like dcm2niix, a series is split into one volume per echo and slice
+    orientation; stacks that still repeat a slice position (e.g. repeated
+    acquisitions) are skipped rather than interleaved into one volume.
+    """
+
+    def __init__(self, num_threads: Optional[int] = None):
+        self.num_threads = num_threads or os.cpu_count() or 1
+
+    @staticmethod
+    def _read(path: str) -> Optional[pydicom.Dataset]:
+        try:
+            ds = pydicom.dcmread(path, force=True)
+        except Exception:
+            return None
+
+        # Only image slices with geometry can be stacked into a volume
+        if 'PixelData' not in ds or 'ImagePositionPatient' not in ds or 'ImageOrientationPatient' not in ds:
+            return None
+        return ds
+
+    @staticmethod
+    def _slice_pixels(ds: pydicom.Dataset) -> np.ndarray:
+        pixels = ds.pixel_array
+        slope = float(getattr(ds, 'RescaleSlope', 1) or 1)
+        intercept = float(getattr(ds, 'RescaleIntercept', 0) or 0)
+        if slope != 1 or intercept != 0:
+            pixels = pixels.astype(np.float32) * slope + intercept
+        # DICOM pixel_array is (rows, cols); NIfTI voxel i runs along the row direction
+        return pixels.T
+
+    def _build_volume(self, slices: List[pydicom.Dataset], pool: ThreadPoolExecutor) -> Tuple[np.ndarray, np.ndarray]:
+        """Stack one series into a volume and its RAS affine"""
+        slices, affine = series_geometry(slices)
+        volume = np.stack(list(pool.map(self._slice_pixels, slices)), axis=-1)
+        return volume, affine
+
+    @staticmethod
+    def _volume_key(ds: pydicom.Dataset) -> Tuple[str, str, Tuple[float, ...]]:
+        """Series, echo and slice orientation; each combination is one volume"""
+        orientation = tuple(round(float(v), 4) for v in ds.ImageOrientationPatient)
+        return str(ds.SeriesInstanceUID), str(getattr(ds, 'EchoNumbers', '') or ''), orientation
+
+    @staticmethod
+    def _unique_name(name: str, used: Set[str]) -> str:
+        """Append a, b, c, ... to a name already written in this study, as dcm2niix does"""
+        candidate = name
+        index = 0
+        while candidate in used:
+            suffix = string.ascii_lowercase[index] if index < 26 else str(index)
+            candidate = f"{name}{suffix}"
+            index += 1
+        used.add(candidate)
+        return candidate
+
+    @staticmethod
+    def _series_name(ds: pydicom.Dataset) -> str:
+        """Protocol_Series_Description, as produced by dcm2niix -f %p_%s_%d"""
+        name = f"{getattr(ds, 'ProtocolName', '')}_{getattr(ds, 'SeriesNumber', '')}_{getattr(ds, 'SeriesDescription', '')}"
+        return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or str(ds.SeriesInstanceUID)
+
+    def convert_study(self, input_dir, output_dir, study_description="spine"):
+        """
+        Convert every stackable series of a DICOM study to NIfTI
+
+        Args:
+            input_dir: Path to DICOM study directory
+            output_dir: Path to output NIfTI directory
+            study_description: Description for logging
+
+        Returns:
+            dict: Paths to converted files (same shape as DICOMConverter)
+        """
+        logger.info(f"Converting {study_description} study in-process")
+        logger.info(f"Input: {input_dir}")
+        logger.info(f"Output: {output_dir}")
+
+        if not os.path.isdir(input_dir):
+            raise ValueError(f"Input directory not found: {input_dir}")
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        paths = [os.path.join(root, name) for root, _, names in os.walk(input_dir) for name in names]
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            volumes = defaultdict(list)
+            for ds in pool.map(self._read, paths):
+                if ds is not None:
+                    volumes[self._volume_key(ds)].append(ds)
+
+            echoes = defaultdict(set)
+            for uid, echo, _ in volumes:
+                echoes[uid].add(echo)
+
+            output_files = []
+            used_names: Set[str] = set()
+            for (uid, echo, _), slices in volumes.items():
+                first = slices[0]
+                if int(getattr(first, 'NumberOfFrames', 1) or 1) > 1:
+                    logger.warning(f"Skipping multi-frame series {uid}; convert it with dcm2niix")
+                    continue
+
+                if len({(ds.Rows, ds.Columns) for ds in slices}) > 1:
+                    logger.warning(f"Skipping series {uid}: inconsistent slice geometry")
+                    continue
+
+                positions = {tuple(round(float(v), 3) for v in ds.ImagePositionPatient) for ds in slices}
+                if len(positions) < len(slices):
+                    logger.warning(f"Skipping series {uid}: {len(slices) - len(positions)} repeated slice positions "
+                                   f"(multiple stacks or acquisitions); convert it with dcm2niix")
+                    continue
+
+                volume, affine = self._build_volume(slices, pool)
+
+                image = nib.Nifti1Image(volume, affine)
+                image.set_qform(affine, code=1)
+                image.set_sform(affine, code=1)
+
+                name = self._series_name(first)
+                if len(echoes[uid]) > 1:
+                    name = f"{name}_e{echo}"
+                output_file = os.path.join(output_dir, f"{self._unique_name(name, used_names)}.nii")
+                nib.save(image, output_file)
+                output_files.append(output_file)
+                logger.info(f"   {os.path.basename(output_file)}: shape {volume.shape}")
+
+        if not output_files:
+            raise RuntimeError(f"No convertible DICOM series found in {input_dir}")
+
+        logger.info(" Conversion successful")
+
+        return {
+            'status': 'success',
+            'output_files': output_files
+        }
@@ -0,0 +1,57 @@
+"""
+Process-wide logging setup for pipeline entry points
+Stage modules only create loggers; the entry point configures handlers once
+"""
+
+import os
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(name)s] - %(message)s'
+
+# Default clinical pipeline log inside the container
+PIPELINE_LOG_FILE = '/app/logs/spine_segmentation.log'
+
+
+def configure_logging(log_file: Optional[str] = None, level: int = logging.INFO):
+    """
+    Send root logger records to stdout and optionally log_file
+
+    Records are handed to a queue and written by a background listener
+    thread, so slow log volumes never block inference. Like basicConfig,
+    this leaves an already configured root logger alone, so call it from
+    the entry point before any work starts.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+
+    file_error = None
+    if log_file:
+        try:
+            os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+            handlers.append(logging.FileHandler(log_file))
+        except OSError as e:
+            file_error = e
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Drain queued records before the interpreter exits
+    atexit.register(listener.stop)
+
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    if file_error is not None:
+        logging.getLogger(__name__).warning(f"Cannot write log file {log_file}: {file_error}; logging to stdout only")
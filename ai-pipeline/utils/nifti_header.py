@@ -0,0 +1,100 @@
+"""
+Lightweight NIfTI header reader
+Parses only the fixed-size header so validation never decodes voxel data
+"""
+
+import gzip
+import struct
+from typing import Dict
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+# Enough for either header plus the 4-byte extension flag
+HEADER_READ_BYTES = 544
+
+
+def _parse_nifti1(raw: bytes, endian: str) -> Dict:
+    dim = struct.unpack_from(f"{endian}8h", raw, 40)
+    datatype, bitpix = struct.unpack_from(f"{endian}2h", raw, 70)
+    pixdim = struct.unpack_from(f"{endian}8f", raw, 76)
+    vox_offset = struct.unpack_from(f"{endian}f", raw, 108)[0]
+    magic = raw[344:348].rstrip(b'\x00').decode('ascii', errors='replace')
+    return {
+        'version': 1,
+        'dim': list(dim),
+        'pixdim': list(pixdim),
+        'datatype': datatype,
+        'bitpix': bitpix,
+        'vox_offset': int(vox_offset),
+        'magic': magic
+    }
+
+
+def _parse_nifti2(raw: bytes, endian: str) -> Dict:
+    magic = raw[4:12].split(b'\x00')[0].decode('ascii', errors='replace')
+    datatype, bitpix = struct.unpack_from(f"{endian}2h", raw, 12)
+    dim = struct.unpack_from(f"{endian}8q", raw, 16)
+    pixdim = struct.unpack_from(f"{endian}8d", raw, 104)
+    vox_offset = struct.unpack_from(f"{endian}q", raw, 168)[0]
+    return {
+        'version': 2,
+        'dim': list(dim),
+        'pixdim': list(pixdim),
+        'datatype': datatype,
+        'bitpix': bitpix,
+        'vox_offset': vox_offset,
+        'magic': magic
+    }
+
+
+def read_header(path: str) -> Dict:
+    """
+    Read the header of a .nii or .nii.gz file
+
+    For .nii.gz only the first gzip block is inflated; the rest of the
+    volume is never decompressed.
+
+    Returns:
+        dict with version, dim, pixdim, datatype, bitpix, vox_offset, magic,
+        shape (spatial/temporal extent) and voxel_count
+    Raises:
+        ValueError if the file is not a valid NIfTI-1/NIfTI-2 image
+    """
+    opener = gzip.open if str(path).endswith('.gz') else open
+    try:
+        with opener(path, 'rb') as f:
+            raw = f.read(HEADER_READ_BYTES)
+    except (OSError, EOFError) as e:
+        raise ValueError(f"Cannot read NIfTI header from {path}: {e}")
+
+    if len(raw) < NIFTI1_HEADER_SIZE:
+        raise ValueError(f"Truncated NIfTI header: {path}")
+
+    # sizeof_hdr doubles as the byte-order marker
+    for endian in ('<', '>'):
+        sizeof_hdr = struct.unpack_from(f"{endian}i", raw, 0)[0]
+        if sizeof_hdr == NIFTI1_HEADER_SIZE:
+            header = _parse_nifti1(raw, endian)
+            break
+        if sizeof_hdr == NIFTI2_HEADER_SIZE and len(raw) >= NIFTI2_HEADER_SIZE:
+            header = _parse_nifti2(raw, endian)
+            break
+    else:
+        raise ValueError(f"Not a NIfTI file (bad sizeof_hdr): {path}")
+
+    ndim = header['dim'][0]
+    if not 1 <= ndim <= 7:
+        raise ValueError(f"Invalid NIfTI dimensions {header['dim']}: {path}")
+
+    shape = header['dim'][1:ndim + 1]
+    if any(d < 1 for d in shape):
+        raise ValueError(f"Invalid NIfTI shape {shape}: {path}")
+
+    voxel_count = 1
+    for d in shape:
+        voxel_count *= d
+
+    header['shape'] = shape
+    header['voxel_count'] = voxel_count
+    return header
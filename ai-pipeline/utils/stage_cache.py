@@ -0,0 +1,252 @@
+"""
+Content-addressed result cache for pipeline stages
+Re-running a stage on identical inputs restores its outputs instead of recomputing
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import inspect
+import logging
+import functools
+from pathlib import Path
+from typing import Any, Callable, List, Sequence
+
+from ai_pipeline.utils.staging import clone
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('SPINEAI_CACHE_DIR', '/app/cache')
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 50 * 1024 ** 3))
+
+RESULT_FILE = "result.json"
+SIZE_FILE = "size"
+OUTPUT_NAME = "output"
+OUTPUT_PLACEHOLDER = "{stage_output}"
+
+
+@functools.lru_cache(maxsize=65536)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    """sha256 of a file; size and mtime are part of the key so edits miss the memory tier"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _input_digests(path: str) -> List[str]:
+    """Digests of a file, or of every file in a directory tree in sorted order"""
+    root = Path(path)
+    if root.is_file():
+        files = [(root.name, root)]
+    else:
+        files = sorted((str(f.relative_to(root)), f) for f in root.rglob('*') if f.is_file())
+
+    digests = []
+    for name, f in files:
+        stat = f.stat()
+        digests.append(f"{name}:{_file_digest(str(f.resolve()), stat.st_size, stat.st_mtime_ns)}")
+    return digests
+
+
+def stage_key(stage_name: str, input_paths: Sequence[str], params: dict, tool_version: str) -> str:
+    """Cache key: sha256 over input file hashes, stage parameters and tool version"""
+    digest = hashlib.sha256(stage_name.encode())
+    for path in input_paths:
+        for file_digest in _input_digests(str(path)):
+            digest.update(file_digest.encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    digest.update(tool_version.encode())
+    return digest.hexdigest()
+
+
+def _copy_tree(src: str, dst: str) -> int:
+    """
+    Mirror a file or directory tree from src to dst with reflinks or copies
+
+    Never hardlinks: stages rewrite their outputs in place, which would
+    otherwise corrupt the cache entry sharing the inode.
+
+    Returns:
+        Total bytes copied
+    """
+    if os.path.isfile(src):
+        clone(src, dst)
+        return os.path.getsize(dst)
+
+    total = 0
+    for dirpath, _, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in filenames:
+            target = clone(os.path.join(dirpath, name), os.path.join(target_dir, name))
+            total += os.path.getsize(target)
+    return total
+
+
+def _rebase(value: Any, old: str, new: str) -> Any:
+    """Rewrite path prefixes inside a (nested) result so it points at another output location"""
+    if isinstance(value, str):
+        if value == old or value.startswith(old + os.sep):
+            return new + value[len(old):]
+        return value
+    if isinstance(value, dict):
+        return {k: _rebase(v, old, new) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_rebase(v, old, new) for v in value]
+    return value
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def _entry_size(path: str) -> int:
+    """Size recorded when the entry was stored; entries without one are walked once"""
+    try:
+        with open(os.path.join(path, SIZE_FILE), 'r') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return _tree_size(path)
+
+
+def _evict(cache_dir: str, max_bytes: int):
+    """Drop least recently used entries until the cache fits in max_bytes"""
+    entries = []
+    total = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.is_dir() or '.tmp' in entry.name:
+                continue
+            size = _entry_size(entry.path)
+            entries.append((entry.stat().st_mtime, size, entry.path))
+            total += size
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        logger.info(f"Evicting cache entry: {path}")
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _restore(entry: Path, output_path: str):
+    """
+    Copy a cached stage output back into place; returns the cached result or None
+
+    Any failure is a cache miss: the entry may be corrupt, have lost its
+    outputs, or be evicted by another thread while it is being copied.
+    """
+    result_file = entry / RESULT_FILE
+    cached_output = entry / OUTPUT_NAME
+    if not result_file.exists():
+        return None
+
+    try:
+        with open(result_file, 'r') as f:
+            result = json.load(f)
+
+        # A result pointing at outputs that no longer exist must not be returned
+        if not cached_output.exists():
+            raise FileNotFoundError(f"cached output missing: {cached_output}")
+
+        _copy_tree(str(cached_output), output_path)
+
+        # Refresh recency for LRU eviction
+        os.utime(entry)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Discarding unusable cache entry {entry.name[:12]}: {e}")
+        # _store skips keys that already have a result, so clear the way for a fresh one
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    return _rebase(result, OUTPUT_PLACEHOLDER, output_path)
+
+
+def _store(entry: Path, output_path: str, result: Any):
+    """Publish a stage output into the cache atomically"""
+    if (entry / RESULT_FILE).exists():
+        return
+
+    staging = entry.with_name(f"{entry.name}.tmp{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    try:
+        size = _copy_tree(output_path, str(staging / OUTPUT_NAME))
+        with open(staging / RESULT_FILE, 'w') as f:
+            json.dump(_rebase(result, output_path, OUTPUT_PLACEHOLDER), f, indent=2)
+        # Recorded so eviction sums one small file per entry instead of walking every output
+        with open(staging / SIZE_FILE, 'w') as f:
+            f.write(str(size))
+        os.rename(staging, entry)
+    finally:
+        # Left behind only if another process published the same key first
+        shutil.rmtree(staging, ignore_errors=True)
+
+    _evict(str(entry.parent), CACHE_MAX_BYTES)
+
+
+def cache_stage(inputs: Sequence[str], output: str, params: Sequence[str] = ()) -> Callable:
+    """
+    Cache a pipeline stage method on disk, keyed by input content
+
+    Args:
+        inputs: Argument names holding input files or directories to hash
+        output: Argument name of the output file or directory the stage writes
+        params: Names of settings that change the output, taken from the call
+            arguments or, failing that, from attributes of the instance
+
+    The instance's ``tool_version`` attribute is part of the key. Set
+    SPINEAI_CACHE_DISABLE=1 to bypass the cache.
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if os.environ.get('SPINEAI_CACHE_DISABLE') == '1':
+                return func(self, *args, **kwargs)
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+
+            raw_output = str(arguments[output])
+            output_path = os.path.abspath(raw_output)
+            settings = {
+                name: arguments[name] if name in arguments else getattr(self, name, None)
+                for name in params
+            }
+            key = stage_key(
+                func.__qualname__,
+                [arguments[name] for name in inputs],
+                settings,
+                getattr(self, 'tool_version', '')
+            )
+            entry = Path(CACHE_DIR) / key
+
+            cached = _restore(entry, output_path)
+            if cached is not None:
+                logger.info(f"♻️  Cache hit for {func.__qualname__} ({key[:12]})")
+                return cached
+
+            result = func(self, *args, **kwargs)
+
+            try:
+                # Results may echo the output path as passed or as absolute
+                _store(entry, output_path, _rebase(result, raw_output, output_path))
+            except (OSError, TypeError) as e:
+                logger.warning(f"Could not cache {func.__qualname__} result: {e}")
+
+            return result
+
+        return wrapper
+
+    return decorator
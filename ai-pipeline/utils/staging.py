@@ -0,0 +1,60 @@
+"""
+Zero-copy staging of intermediate files between pipeline stages
+"""
+
+import os
+import fcntl
+import shutil
+
+# ioctl request that shares a file's extents with another (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def stage(src: str, dst: str) -> str:
+    """
+    Make the file at src available at dst without copying bytes through Python
+
+    Hardlinks when both paths are on the same filesystem; otherwise falls
+    back to shutil.copyfile, which copies in-kernel via os.sendfile on Linux.
+    An existing dst is replaced.
+
+    Returns:
+        dst
+    """
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Cross-device (EXDEV) or a filesystem without hardlink support
+        shutil.copyfile(src, dst)
+
+    return dst
+
+
+def clone(src: str, dst: str) -> str:
+    """
+    Copy the file at src to dst as an independent file
+
+    Reflinks on copy-on-write filesystems so no bytes are copied until one
+    side is modified; otherwise falls back to shutil.copyfile. Unlike
+    stage(), src and dst never share an inode, so rewriting one in place
+    leaves the other intact. An existing dst is replaced.
+
+    Returns:
+        dst
+    """
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        # No reflink support (EOPNOTSUPP), cross-device (EXDEV) or another filesystem limit
+        shutil.copyfile(src, dst)
+
+    return dst
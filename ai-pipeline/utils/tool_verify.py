@@ -0,0 +1,61 @@
+"""
+Process-wide check for the external tools the pipeline shells out to
+Each tool is probed at most once per process
+"""
+
+import os
+import functools
+import subprocess
+from typing import Tuple
+
+
+@functools.lru_cache(maxsize=None)
+def _probe(tool: str, args: Tuple[str, ...], timeout: int) -> Tuple[int, str]:
+    """Return code and stdout of `tool *args`"""
+    try:
+        result = subprocess.run(
+            [tool, *args],
+            capture_output=True,
+            timeout=timeout
+        )
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        raise RuntimeError(f"{tool} not found or not responding: {e}")
+
+    return result.returncode, result.stdout.decode('utf-8', errors='replace')
+
+
+def verify_tool(tool: str, args: Tuple[str, ...], ok_returncodes: Tuple[int, ...] = (0,),
+                timeout: int = 30) -> str:
+    """
+    Run `tool *args` once per process and return its stdout
+
+    Successful probes are cached, so constructing many converters or
+    inference engines forks each tool only once. Set SPINEAI_SKIP_VERIFY=1
+    to skip probing entirely (returns an empty string).
+
+    Raises:
+        RuntimeError if the tool is missing, hangs or exits with an unexpected code
+    """
+    if os.environ.get('SPINEAI_SKIP_VERIFY') == '1':
+        return ''
+
+    returncode, stdout = _probe(tool, tuple(args), timeout)
+    if returncode not in ok_returncodes:
+        raise RuntimeError(f"{tool} {' '.join(args)} exited with code {returncode}")
+
+    return stdout
+
+
+def read_tool_version(tool: str, args: Tuple[str, ...], timeout: int = 30) -> str:
+    """
+    Version banner printed by `tool *args`, stripped
+
+    Read even with SPINEAI_SKIP_VERIFY=1, since cache keys depend on it, so
+    callers should only ask for it when building a cache key. Shares
+    verify_tool's probe, so the tool is still forked only once.
+    Returns an empty string if the tool cannot be run.
+    """
+    try:
+        return _probe(tool, tuple(args), timeout)[1].strip()
+    except RuntimeError:
+        return ''
@@ -0,0 +1,159 @@
+"""
+io_uring batch writer (Linux only)
+Coalesces output writes into batched submissions with asynchronous fsync
+"""
+
+import os
+import sys
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from liburing import (
+    io_uring,
+    io_uring_cqe,
+    io_uring_queue_init,
+    io_uring_queue_exit,
+    io_uring_get_sqe,
+    io_uring_prep_write,
+    io_uring_prep_fsync,
+    io_uring_submit,
+    io_uring_wait_cqe,
+    io_uring_cqe_seen
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IoUringBatchEngine:
+    """
+    Batched write engine on top of liburing
+
+    write() only queues a submission; the ring is submitted every max_batch
+    requests and by flush(), which also fsyncs every file written since the
+    previous flush. Buffers are kept alive until their completion is reaped.
+    Use as a context manager (or call close()) to release the ring.
+    """
+
+    def __init__(self, entries: int = 64, max_batch: int = 16):
+        if not sys.platform.startswith('linux'):
+            raise RuntimeError("io_uring is only available on Linux")
+
+        self.entries = entries
+        self.max_batch = max_batch
+
+        self._ring = io_uring()
+        self._cqe = io_uring_cqe()
+        io_uring_queue_init(entries, self._ring, 0)
+
+        # user_data -> (fd, buffer, offset); buffer is None for fsync requests
+        self._requests: Dict[int, Tuple[int, Optional[memoryview], int]] = {}
+        self._next_id = 0
+        self._queued = 0
+        self._offsets: Dict[int, int] = {}
+        # Descriptors opened by write_file(), closed once flushed
+        self._owned_fds: List[int] = []
+        self._closed = False
+
+    def _get_sqe(self):
+        # Keep in-flight requests within the ring size so neither queue overflows
+        # (reaping can re-queue short writes, hence the loop)
+        while len(self._requests) >= self.entries:
+            self._submit()
+            self._reap(len(self._requests))
+        return io_uring_get_sqe(self._ring)
+
+    def _track(self, sqe, fd: int, buf: Optional[memoryview], offset: int):
+        sqe.user_data = self._next_id
+        self._requests[self._next_id] = (fd, buf, offset)
+        self._next_id += 1
+        self._queued += 1
+
+        if self._queued >= self.max_batch:
+            self._submit()
+
+    def _queue_write(self, fd: int, buf: memoryview, offset: int):
+        sqe = self._get_sqe()
+        io_uring_prep_write(sqe, fd, buf, len(buf), offset)
+        self._track(sqe, fd, buf, offset)
+
+    def _submit(self):
+        if self._queued:
+            io_uring_submit(self._ring)
+            self._queued = 0
+
+    def _reap(self, count: int):
+        short_writes = []
+        for _ in range(count):
+            io_uring_wait_cqe(self._ring, self._cqe)
+            res = self._cqe.res
+            user_data = self._cqe.user_data
+            io_uring_cqe_seen(self._ring, self._cqe)
+
+            fd, buf, offset = self._requests.pop(user_data)
+            if res < 0:
+                raise OSError(-res, os.strerror(-res))
+
+            if buf is not None and res < len(buf):
+                short_writes.append((fd, buf[res:], offset + res))
+
+        # Re-queue remainders only once this reap has consumed every completion
+        # it was asked for; queueing may itself reap when the ring is full
+        for fd, buf, offset in short_writes:
+            self._queue_write(fd, buf, offset)
+
+    def write(self, fd: int, buf: bytes, offset: Optional[int] = None):
+        """
+        Queue a write of buf to fd
+
+        Without an explicit offset, writes to the same fd are appended one
+        after another starting at 0.
+        """
+        if offset is None:
+            offset = self._offsets.get(fd, 0)
+        self._offsets[fd] = offset + len(buf)
+
+        self._queue_write(fd, memoryview(buf), offset)
+
+    def write_file(self, path: str, buf: bytes):
+        """Queue writing buf as the whole content of path; the file is closed by the next flush()"""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._owned_fds.append(fd)
+        self.write(fd, buf, 0)
+
+    def flush(self):
+        """Complete all queued writes, then fsync every file written to"""
+        while self._requests:
+            self._submit()
+            self._reap(len(self._requests))
+
+        for fd in self._offsets:
+            sqe = self._get_sqe()
+            io_uring_prep_fsync(sqe, fd, 0)
+            self._track(sqe, fd, None, 0)
+
+        self._submit()
+        self._reap(len(self._requests))
+        self._offsets.clear()
+
+        while self._owned_fds:
+            os.close(self._owned_fds.pop())
+
+    def close(self):
+        """Flush outstanding work and release the ring"""
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            self.flush()
+        finally:
+            for fd in self._owned_fds:
+                os.close(fd)
+            self._owned_fds.clear()
+            io_uring_queue_exit(self._ring)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,20 +1,62 @@
 #!/usr/bin/env python3
 """Example: Complete spine segmentation pipeline"""
 
+import os
+import asyncio
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
 from ai_pipeline.preprocessing.dcm2niix_converter import DICOMConverter
 from ai_pipeline.inference.spine_segmentation import TotalSpineSegInference
 from ai_pipeline.postprocessing.seg_converter import SEGConverter
+from ai_pipeline.utils.log_setup import PIPELINE_LOG_FILE, configure_logging
+from ai_pipeline.utils.staging import clone
+
+
+def stage_segmentation(ai_results, final_output):
+    """
+    Stage the step 2 segmentation next to the final DICOM SEG
+
+    The NIfTI doubles as the research/analysis output, so it is cloned
+    (reflinked where the filesystem supports it) rather than hardlinked:
+    cleaning up or rerunning work_dir must not touch the deliverable.
+    Returns its path.
+    """
+    # Sorted so the pick does not depend on directory listing order
+    step2_files = sorted(ai_results['output_files']['step2_output'])
+    if len(step2_files) > 1:
+        print(f"⚠️  {len(step2_files)} step2 segmentations found, using {step2_files[0]}")
+
+    # Keep the source suffix: a plain .nii staged as .nii.gz would not be gzip data
+    suffix = ".nii.gz" if step2_files[0].endswith(".nii.gz") else ".nii"
+    seg_nifti = os.path.splitext(final_output)[0] + suffix
+    return clone(step2_files[0], seg_nifti)
+
 
+def process_spine_study(dicom_input, work_dir, final_output, in_process_dicom=False,
+                        persistent=False, precision=None):
+    """
+    Complete pipeline: DICOM → NIfTI → AI → DICOM SEG
 
-def process_spine_study(dicom_input, work_dir, final_output):
-    """Complete pipeline: DICOM → NIfTI → AI → DICOM SEG"""
+    in_process_dicom reads the study with pydicom and writes uncompressed
+    NIfTI instead of running dcm2niix with gzip output. persistent and
+    precision are passed to TotalSpineSegInference; bf16 needs the
+    persistent model server.
+    """
 
     # Stage 1: DICOM to NIfTI
     print("=" * 60)
     print("STAGE 1: DICOM Conversion")
     print("=" * 60)
 
-    converter = DICOMConverter()
+    if in_process_dicom:
+        # numpy/nibabel/pydicom are only loaded when the in-process reader is used
+        from ai_pipeline.preprocessing.dicom_loader import DICOMVolumeLoader
+        converter = DICOMVolumeLoader()
+    else:
+        converter = DICOMConverter()
     nifti_result = converter.convert_study(dicom_input, f"{work_dir}/nifti")
 
     # Stage 2: AI Segmentation
@@ -22,33 +64,242 @@ def process_spine_study(dicom_input, work_dir, final_output):
     print("STAGE 2: AI Segmentation")
     print("=" * 60)
 
-    inference = TotalSpineSegInference()
-    ai_results = inference.run_inference(
-        nifti_result['output_dir'],
-        f"{work_dir}/ai_output"
-    )
+    # All converted series go through one TotalSpineSeg run (single model load)
+    # Masks on the source grid let stage 3 use the in-process DICOM SEG encoder
+    inference = TotalSpineSegInference(persistent=persistent, precision=precision, iso_output=False)
+    try:
+        ai_results = inference.run_batch(
+            nifti_result['output_files'],
+            f"{work_dir}/ai_output"
+        )
+    finally:
+        if persistent:
+            inference.shutdown()
 
     # Stage 3: DICOM SEG Generation
     print("\n" + "=" * 60)
     print("STAGE 3: DICOM SEG Conversion")
     print("=" * 60)
 
-    seg_converter = SEGConverter()
-    seg_result = seg_converter.convert_to_seg(
-        f"{work_dir}/ai_output/step2_output/study.nii.gz",
-        dicom_input,
-        final_output
-    )
+    with SEGConverter() as seg_converter:
+        seg_result = seg_converter.convert_to_seg(
+            stage_segmentation(ai_results, final_output),
+            dicom_input,
+            final_output,
+            source_space=not ai_results.get('iso_output', True)
+        )
 
     print("\n COMPLETE PIPELINE FINISHED!")
     print(f"📄 Final DICOM SEG: {final_output}")
 
 
+# Inference engine of the current BatchPipeline GPU worker process
+_worker_inference = None
+
+
+def _init_gpu_worker(gpu_ids, model_data_dir, precision):
+    """
+    GPU worker initializer: pin the process to one device and start a
+    persistent model server, so the worker pays the model load once rather
+    than once per study
+    """
+    global _worker_inference
+    configure_logging(PIPELINE_LOG_FILE)
+    os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu_ids.get())
+    _worker_inference = TotalSpineSegInference(model_data_dir=model_data_dir, persistent=True,
+                                               precision=precision, iso_output=False)
+
+    # Runs when the pool tears the worker down, before multiprocessing
+    # terminates the daemonic server, so the server exits gracefully
+    multiprocessing.util.Finalize(_worker_inference, _worker_inference.shutdown, exitpriority=10)
+
+
+def _run_gpu_inference(nifti_files, output_dir):
+    return _worker_inference.run_batch(nifti_files, output_dir)
+
+
+class BatchPipeline:
+    """
+    Multi-study pipeline that overlaps CPU stages with GPU inference
+
+    dcm2niix and DICOM SEG conversion run on a thread pool while TotalSpineSeg
+    runs in one worker process per GPU, so study N+1 is converted while
+    study N is on the GPU. Each worker keeps a persistent model server for
+    the lifetime of the pool, so precision may be fp16 or bf16.
+
+    At most num_gpus conversions run at a time, each compressing with an
+    equal share of the cores through pigz, and the thread pool defaults to
+    one thread per conversion plus one per DICOM SEG conversion.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, num_gpus: int = 1,
+                 model_data_dir: str = "/app/models", precision: Optional[str] = None):
+        # Checked here rather than in every GPU worker initializer
+        supported = TotalSpineSegInference.SUPPORTED_PRECISIONS['server']
+        if precision is not None and precision not in supported:
+            raise ValueError(
+                f"Precision {precision} is not supported by the model server "
+                f"(supported: {', '.join(supported)})"
+            )
+
+        self.num_gpus = num_gpus
+        self.num_workers = num_workers or 2 * num_gpus
+        self.model_data_dir = model_data_dir
+        self.precision = precision
+        self.dicom_converter = DICOMConverter(
+            compression_threads=max(1, (os.cpu_count() or 1) // num_gpus)
+        )
+        self.seg_converter = SEGConverter()
+
+    def run(self, studies: Sequence[Tuple[str, str, str]]) -> List[Dict]:
+        """
+        Process studies concurrently
+
+        Args:
+            studies: (dicom_input, work_dir, final_output) per study
+
+        Returns:
+            Per-study result dicts, in input order; failed studies carry
+            status 'failed' and the error instead of aborting the batch
+        """
+        return asyncio.run(self._run(list(studies)))
+
+    def _finalize_study(self, ai_results: Dict, dicom_input: str, final_output: str) -> Dict:
+        """Stage the segmentation and convert it to DICOM SEG (runs on the thread pool)"""
+        seg_nifti = stage_segmentation(ai_results, final_output)
+        return self.seg_converter.convert_to_seg(
+            seg_nifti, dicom_input, final_output,
+            source_space=not ai_results.get('iso_output', True)
+        )
+
+    async def _run(self, studies: List[Tuple[str, str, str]]) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+
+        # spawn keeps CUDA state out of the parent; each worker takes one GPU id
+        ctx = multiprocessing.get_context('spawn')
+        gpu_ids = ctx.Queue()
+        for gpu_id in range(self.num_gpus):
+            gpu_ids.put(gpu_id)
+
+        results: List[Optional[Dict]] = [None] * len(studies)
+
+        # Bounded hand-off between stages: a study holds a slot from the start
+        # of its conversion until a GPU consumer takes it, so preprocessing
+        # runs at most num_gpus studies ahead of inference
+        ahead = asyncio.Semaphore(self.num_gpus)
+        ready = asyncio.Queue(maxsize=self.num_gpus)
+        postprocess_tasks = []
+
+        def fail(index: int, stage: str, error: Exception):
+            print(f"Study {studies[index][0]} failed during {stage}: {error}")
+            results[index] = {
+                'status': 'failed',
+                'dicom_input': studies[index][0],
+                'stage': stage,
+                'error': str(error)
+            }
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as cpu_pool, \
+                ProcessPoolExecutor(max_workers=self.num_gpus, mp_context=ctx,
+                                    initializer=_init_gpu_worker,
+                                    initargs=(gpu_ids, self.model_data_dir, self.precision)) as gpu_pool:
+
+            async def preprocess(index: int):
+                dicom_input, work_dir, _ = studies[index]
+                await ahead.acquire()
+                try:
+                    nifti_result = await loop.run_in_executor(
+                        cpu_pool, self.dicom_converter.convert_study, dicom_input, f"{work_dir}/nifti"
+                    )
+                except Exception as e:
+                    ahead.release()
+                    fail(index, 'preprocessing', e)
+                    return
+                await ready.put((index, nifti_result))
+
+            async def postprocess(index: int, ai_results: Dict):
+                dicom_input, _, final_output = studies[index]
+                try:
+                    # Staging copies the NIfTI when reflinks are unavailable,
+                    # so it stays off the event loop along with the conversion
+                    seg_result = await loop.run_in_executor(
+                        cpu_pool, self._finalize_study, ai_results, dicom_input, final_output
+                    )
+                except Exception as e:
+                    fail(index, 'postprocessing', e)
+                    return
+
+                results[index] = {
+                    'status': 'success',
+                    'dicom_input': dicom_input,
+                    'final_output': seg_result['output_file'],
+                    'inference_time_sec': ai_results['inference_time_sec']
+                }
+
+            async def gpu_consumer():
+                # One consumer per GPU worker, so at most num_gpus studies
+                # are ever in flight on the GPUs
+                while True:
+                    item = await ready.get()
+                    if item is None:
+                        return
+
+                    index, nifti_result = item
+                    ahead.release()
+                    work_dir = studies[index][1]
+                    try:
+                        ai_results = await loop.run_in_executor(
+                            gpu_pool, _run_gpu_inference, nifti_result['output_files'], f"{work_dir}/ai_output"
+                        )
+                    except Exception as e:
+                        fail(index, 'inference', e)
+                        continue
+
+                    postprocess_tasks.append(asyncio.create_task(postprocess(index, ai_results)))
+
+            consumers = [asyncio.create_task(gpu_consumer()) for _ in range(self.num_gpus)]
+
+            await asyncio.gather(*(preprocess(i) for i in range(len(studies))))
+            for _ in consumers:
+                await ready.put(None)
+
+            await asyncio.gather(*consumers)
+            await asyncio.gather(*postprocess_tasks)
+
+        return results
+
+
 if __name__ == "__main__":
-    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Complete spine segmentation pipeline")
+    parser.add_argument("dicom_input", help="Source DICOM study directory")
+    parser.add_argument("work_dir", help="Working directory for intermediate outputs")
+    parser.add_argument("final_output", help="Output DICOM SEG file")
+    parser.add_argument(
+        "--in-process-dicom",
+        action="store_true",
+        help="Convert DICOM in-process with pydicom (uncompressed NIfTI) instead of dcm2niix"
+    )
+
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Run TotalSpineSeg in a persistent model server process (required for bf16)"
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["fp16", "bf16"],
+        help="Network precision: fp16, or bf16 with --persistent (default: nnU-Net's fp16 autocast)"
+    )
+
+    args = parser.parse_args()
+    if args.precision == 'bf16' and not args.persistent:
+        parser.error("--precision bf16 requires --persistent")
 
-    if len(sys.argv) != 4:
-        print("Usage: python pipeline.py <dicom_input> <work_dir> <final_output>")
-        sys.exit(1)
+    # Before any stage runs, so every stage module logs through the same handlers
+    configure_logging(PIPELINE_LOG_FILE)
 
-    process_spine_study(sys.argv[1], sys.argv[2], sys.argv[3])
\ No newline at end of file
+    process_spine_study(args.dicom_input, args.work_dir, args.final_output,
+                        in_process_dicom=args.in_process_dicom,
+                        persistent=args.persistent, precision=args.precision)
\ No newline at end of file
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Build shape-specialized TensorRT engines for the ONNX backend
+Engines are compiled for the most common volume shapes in a sample set of
+NIfTI files and cached next to the ONNX models for OnnxSpineSeg to pick up
+"""
+
+import json
+import argparse
+import logging
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+from ai_pipeline.inference.onnx_backend import (
+    TRT_CACHE_DIR,
+    TRT_MANIFEST,
+    model_filename,
+    shape_key,
+    tile_grid,
+    trt_cache_dir,
+    trt_provider_options
+)
+from ai_pipeline.utils.nifti_header import read_header
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def common_shapes(sample_dir: Path, top_k: int):
+    """Most frequent (X, Y, Z) shapes among the NIfTI headers in sample_dir"""
+    shapes = Counter()
+    for path in sample_dir.rglob("*"):
+        if not path.name.endswith(('.nii', '.nii.gz')):
+            continue
+        try:
+            shapes[tuple(read_header(str(path))['shape'][:3])] += 1
+        except ValueError as e:
+            logger.warning(f"Skipping {path}: {e}")
+
+    return shapes.most_common(top_k)
+
+
+def engine_batch_size(num_tiles: int, max_batch: int) -> int:
+    """Largest batch size up to max_batch that splits the tiles evenly, so no batch needs padding"""
+    return max(b for b in range(1, min(num_tiles, max_batch) + 1) if num_tiles % b == 0)
+
+
+def build_engine(onnx_dir: Path, step: str, input_shape, precision: str, key: str):
+    """
+    Compile one engine into its cache directory by running a dummy batch through the TensorRT EP
+
+    The engine is built from the same ONNX file OnnxSpineSeg serves at this
+    precision, since TensorRT only reuses engines built from that model.
+    """
+    model_path = onnx_dir / model_filename(step, precision)
+    if not model_path.exists():
+        export_cmd = "tools/export_onnx.py --fp16" if precision == "fp16" else "tools/export_onnx.py"
+        raise FileNotFoundError(f"ONNX model not found: {model_path}. Run {export_cmd} first")
+
+    options = trt_provider_options(
+        input_shape, trt_cache_dir(str(onnx_dir), step, precision, key), fp16=precision == 'fp16'
+    )
+    session = ort.InferenceSession(
+        str(model_path),
+        providers=[('TensorrtExecutionProvider', options)]
+    )
+    input_name = session.get_inputs()[0].name
+    session.run(None, {input_name: np.zeros(input_shape, dtype=np.float32)})
+
+
+def main():
+    """CLI interface for TensorRT engine builds"""
+    parser = argparse.ArgumentParser(
+        description="Build shape-specialized TensorRT engines for the ONNX backend",
+        epilog="Example: python tools/build_trt_engines.py /app/models/onnx /data/sample_nifti --top-k 3"
+    )
+
+    parser.add_argument("onnx_dir", help="Directory with step1/step2 ONNX models")
+    parser.add_argument("sample_dir", help="Representative NIfTI files (e.g. dcm2niix output of a DICOM set)")
+    parser.add_argument("--top-k", type=int, default=3, help="Number of shapes to specialize (default: 3)")
+    parser.add_argument("--steps", nargs="+", default=["step2"], choices=["step1", "step2"],
+                        help="Steps to build engines for (default: step2)")
+    parser.add_argument("--max-batch", type=int, default=8, help="Maximum tiles per engine call (default: 8)")
+    parser.add_argument("--tile-step", type=float, default=0.5, help="Sliding-window step used at inference")
+    parser.add_argument("--precision", choices=["fp32", "fp16"], default="fp32",
+                        help="Precision of the served model to build engines for; fp16 uses step*_fp16.onnx "
+                             "(default: fp32, matching OnnxSpineSeg)")
+
+    args = parser.parse_args()
+
+    onnx_dir = Path(args.onnx_dir)
+
+    if 'TensorrtExecutionProvider' not in ort.get_available_providers():
+        logger.error("TensorrtExecutionProvider is not available in this onnxruntime build")
+        exit(1)
+
+    try:
+        shapes = common_shapes(Path(args.sample_dir), args.top_k)
+        if not shapes:
+            raise RuntimeError(f"No NIfTI files found in {args.sample_dir}")
+
+        precision = args.precision
+
+        # Engines for other steps and precisions stay listed
+        manifest = {}
+        if (onnx_dir / TRT_MANIFEST).exists():
+            with open(onnx_dir / TRT_MANIFEST, 'r') as f:
+                manifest = json.load(f)
+
+        for step in args.steps:
+            with open(onnx_dir / f"{step}.json", 'r') as f:
+                config = json.load(f)
+
+            engines = manifest.setdefault(step, {}).setdefault(precision, {})
+            for shape, count in shapes:
+                starts = tile_grid(shape, config, args.tile_step)
+                num_tiles = int(np.prod([len(s) for s in starts]))
+                batch_size = engine_batch_size(num_tiles, args.max_batch)
+                input_shape = [batch_size, config['num_input_channels']] + list(config['patch_size'])
+
+                key = shape_key(shape)
+                logger.info(f"Building {precision} {step} engine for {key} ({count} series, "
+                            f"{num_tiles} tiles, batch {batch_size})")
+                build_engine(onnx_dir, step, input_shape, precision, key)
+
+                engines[key] = {
+                    "input_shape": input_shape,
+                    "tiles": num_tiles
+                }
+
+        with open(onnx_dir / TRT_MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        print(f"\nTensorRT engines built: {onnx_dir / TRT_CACHE_DIR}")
+
+    except Exception as e:
+        logger.error(f"Engine build failed: {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
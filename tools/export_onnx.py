@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Export TotalSpineSeg nnU-Net weights to ONNX
+Writes step1.onnx / step2.onnx plus JSON sidecars for the ONNX Runtime backend
+"""
+
+import json
+import argparse
+import logging
+from pathlib import Path
+
+import torch
+from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# nnU-Net dataset names used by TotalSpineSeg for each stage
+STEP_DATASETS = {
+    "step1": "Dataset101_TotalSpineSeg_step1",
+    "step2": "Dataset102_TotalSpineSeg_step2"
+}
+
+
+def find_model_folder(models_dir: Path, dataset: str) -> Path:
+    """Locate the trained nnU-Net folder (the one holding plans.json) for a dataset"""
+    for plans_file in sorted(models_dir.rglob("plans.json")):
+        if dataset in str(plans_file.parent):
+            return plans_file.parent
+    raise FileNotFoundError(f"No trained model for {dataset} under {models_dir}")
+
+
+def convert_fp16(onnx_path: Path) -> Path:
+    """Write an FP16 copy of an exported model next to it, keeping float32 inputs and outputs"""
+    import onnx
+    from onnxconverter_common import float16
+
+    model = float16.convert_float_to_float16(onnx.load(str(onnx_path)), keep_io_types=True)
+    fp16_path = onnx_path.with_name(f"{onnx_path.stem}_fp16.onnx")
+    onnx.save(model, str(fp16_path))
+    return fp16_path
+
+
+def export_step(model_folder: Path, output_dir: Path, step: str, fold: str, checkpoint: str, opset: int,
+                fp16: bool = False):
+    """Export one nnU-Net network and its inference config"""
+    logger.info(f"Exporting {step} from {model_folder}")
+
+    predictor = nnUNetPredictor(device=torch.device('cpu'), perform_everything_on_device=False)
+    predictor.initialize_from_trained_model_folder(
+        str(model_folder),
+        use_folds=(fold if fold == 'all' else int(fold),),
+        checkpoint_name=checkpoint
+    )
+
+    network = predictor.network
+    network.load_state_dict(predictor.list_of_parameters[0])
+    network.eval()
+
+    patch_size = list(predictor.configuration_manager.patch_size)
+    num_input_channels = len(predictor.dataset_json['channel_names'])
+    num_classes = predictor.label_manager.num_segmentation_heads
+
+    dummy_input = torch.zeros(1, num_input_channels, *patch_size, dtype=torch.float32)
+    onnx_path = output_dir / f"{step}.onnx"
+
+    with torch.no_grad():
+        torch.onnx.export(
+            network,
+            dummy_input,
+            str(onnx_path),
+            opset_version=opset,
+            input_names=['input'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input': {0: 'batch', 2: 'x', 3: 'y', 4: 'z'},
+                'logits': {0: 'batch', 2: 'x', 3: 'y', 4: 'z'}
+            }
+        )
+
+    config = {
+        "patch_size": patch_size,
+        "num_input_channels": num_input_channels,
+        "num_classes": num_classes,
+        "spacing": list(predictor.configuration_manager.spacing),
+        "transpose_forward": list(predictor.plans_manager.transpose_forward),
+        "source_model": str(model_folder)
+    }
+    with open(output_dir / f"{step}.json", 'w') as f:
+        json.dump(config, f, indent=2)
+
+    logger.info(f"Saved {onnx_path} (patch {patch_size}, {num_classes} classes)")
+
+    if fp16:
+        logger.info(f"Saved {convert_fp16(onnx_path)}")
+
+
+def main():
+    """CLI interface for ONNX export"""
+    parser = argparse.ArgumentParser(
+        description="Export TotalSpineSeg nnU-Net weights to ONNX",
+        epilog="Example: python tools/export_onnx.py /app/models /app/models/onnx"
+    )
+
+    parser.add_argument("models_dir", help="TotalSpineSeg data directory (TOTALSPINESEG_DATA)")
+    parser.add_argument("output_dir", help="Output directory for ONNX models")
+    parser.add_argument("--fold", default="0", help="nnU-Net fold to export (default: 0)")
+    parser.add_argument("--checkpoint", default="checkpoint_final.pth", help="Checkpoint file name")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version (default: 17)")
+    parser.add_argument("--fp16", action="store_true",
+                        help="Also write FP16 models (step1_fp16.onnx, step2_fp16.onnx) for --precision fp16")
+
+    args = parser.parse_args()
+
+    models_dir = Path(args.models_dir)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        for step, dataset in STEP_DATASETS.items():
+            model_folder = find_model_folder(models_dir, dataset)
+            export_step(model_folder, output_dir, step, args.fold, args.checkpoint, args.opset, args.fp16)
+
+        print(f"\nONNX export completed: {output_dir}")
+
+    except Exception as e:
+        logger.error(f"Export failed: {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()